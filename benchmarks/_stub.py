@@ -0,0 +1,44 @@
+"""Local HTTP stub server used by benchmarks."""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+
+
+class StubHandler(BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'  # Allows keep-alive.
+    disable_nagle_algorithm = True
+
+    body = b'{"success": true}'
+    content_type = 'application/json'
+
+    def do_GET(self):
+        body = self.server.get_body(self.path)
+        self.send_response(200)
+        self.send_header('Content-Type', self.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, body_getter=None):
+        super().__init__(('127.0.0.1', 0), StubHandler)
+        self.get_body = body_getter or (lambda path: StubHandler.body)
+
+    @property
+    def url(self):
+        return 'http://%s:%s' % self.server_address
+
+    def __enter__(self):
+        Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
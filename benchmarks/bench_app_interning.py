@@ -0,0 +1,105 @@
+"""Compares application details fetches and memory used
+when traversing a large inventory with and without Application interning.
+
+    $ python benchmarks/bench_app_interning.py [items_count] [apps_count]
+
+"""
+import json
+import sys
+import tracemalloc
+from os import path
+from time import perf_counter
+
+import requests
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from steampak.webapi.resources.apps import Application, AppDetailsResolver  # noqa
+from steampak.webapi.resources.market import TAG_ITEM_CLASS_CARD  # noqa
+from steampak.webapi.resources.user import User  # noqa
+from steampak.webapi.http import HttpClient, RateLimiter  # noqa
+
+
+class CannedClient(HttpClient):
+    """Client responding without going to network and counting requests."""
+
+    def __init__(self, inventory):
+        super().__init__(limiter=RateLimiter({}))
+        self.inventory = json.dumps(inventory).encode()
+        self.requests_count = 0
+
+    def get(self, url, params=None, **kwargs):
+        self.requests_count += 1
+
+        if 'appdetails' in url:
+            appids = url.split('appids=')[1].split(',')
+            content = {appid: {'success': True, 'data': {
+                'name': 'Application %s' % appid,
+                'categories': [{'id': idx, 'description': 'Category %s' % idx} for idx in range(20)],
+                'short_description': 'Some description ' * 20,
+            }} for appid in appids}
+            content = json.dumps(content).encode()
+
+        elif 'xml' in url:
+            content = b'<profile><steamID64>76561197960287930</steamID64></profile>'
+
+        else:
+            content = self.inventory
+
+        response = requests.Response()
+        response.status_code = 200
+        response._content = content
+        return response
+
+
+def get_inventory(items_count, apps_count):
+    descriptions = []
+
+    for idx in range(items_count):
+        descriptions.append({
+            'classid': str(idx),
+            'instanceid': '0',
+            'name': 'Card %s' % idx,
+            'market_fee_app': idx % apps_count,
+            'tags': [{'internal_name': TAG_ITEM_CLASS_CARD}],
+        })
+
+    return {'success': 1, 'assets': [], 'descriptions': descriptions}
+
+
+def run(title, client):
+    Application.resolver = AppDetailsResolver()
+
+    tracemalloc.start()
+    started = perf_counter()
+
+    items = list(User('idle', client=client).traverse_inventory(item_filter=TAG_ITEM_CLASS_CARD))
+    titles = {item.app.title for item in items}
+
+    elapsed = perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    apps_count = len({id(item.app) for item in items})
+
+    print('%-14s %6d requests, %6d app objects, %4d titles, peak memory %7.1f MB, %.2f s' % (
+        title, client.requests_count, apps_count, len(titles), peak / 1024 / 1024, elapsed))
+
+
+def main():
+    items_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    apps_count = int(sys.argv[2]) if len(sys.argv) > 2 else 500
+
+    inventory = get_inventory(items_count, apps_count)
+
+    registry = Application.registry
+
+    Application.registry = None
+    run('no interning', CannedClient(inventory))
+
+    Application.registry = registry
+    run('interning', CannedClient(inventory))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+"""Compares market search results page parsing time.
+
+    $ python benchmarks/bench_card_parsing.py [repeat_count]
+
+"""
+import json
+import sys
+from os import path
+from timeit import timeit
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from bs4 import BeautifulSoup  # noqa
+from steampak.webapi.resources.apps import Application  # noqa
+
+FIXTURE = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'tests', 'fixtures', 'market_search_render.json')
+
+
+def parse_soup(html, features):
+    soup = BeautifulSoup(html, features)
+    return [row.select('.market_listing_item_name')[0].text for row in soup.select('.market_listing_row_link')]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    with open(FIXTURE) as f:
+        html = json.load(f)['results_html']
+
+    variants = [
+        ('html5lib', lambda: parse_soup(html, 'html5lib')),
+        ('html.parser', lambda: parse_soup(html, 'html.parser')),
+        ('extractor', lambda: Application._get_card_names(html)),
+    ]
+
+    try:
+        import lxml  # noqa
+        variants.insert(2, ('lxml', lambda: parse_soup(html, 'lxml')))
+
+    except ImportError:
+        pass
+
+    expected = variants[0][1]()
+
+    for title, func in variants:
+        assert func() == expected, title
+        elapsed = timeit(func, number=count)
+        print('%-12s %8.3f ms per page' % (title, elapsed / count * 1000))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Compares owned games list parsing: full tree vs streaming.
+
+Profile XML is served by a local HTTP stub.
+
+    $ python benchmarks/bench_games_xml.py [games_count]
+
+"""
+import sys
+import tracemalloc
+from os import path
+from time import perf_counter
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from steampak.webapi.resources import user as user_module  # noqa
+from steampak.webapi.settings import URL_COMMUNITY_BASE  # noqa
+from steampak.webapi.http import HttpClient, RateLimiter  # noqa
+from steampak.webapi.utils import DataFetcher, str_sub  # noqa
+from _stub import StubServer  # noqa
+
+GAME = '''
+		<game>
+			<appID>%(appid)s</appID>
+			<name><![CDATA[Some Game Title Number %(appid)s: Remastered Edition]]></name>
+			<logo><![CDATA[https://steamcdn-a.akamaihd.net/steam/apps/%(appid)s/capsule_184x69.jpg]]></logo>
+			<storeLink><![CDATA[https://steamcommunity.com/app/%(appid)s]]></storeLink>
+			<hoursLast2Weeks>1.5</hoursLast2Weeks>
+			<hoursOnRecord>%(appid)s.1</hoursOnRecord>
+			<statsLink><![CDATA[https://steamcommunity.com/id/idlesign/stats/%(appid)s]]></statsLink>
+			<globalStatsLink><![CDATA[https://steamcommunity.com/stats/%(appid)s/achievements/]]></globalStatsLink>
+		</game>'''
+
+
+def get_profile(games_count):
+    return (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<gamesList>\n\t<steamID64>76561197960287930</steamID64>\n\t<steamID><![CDATA[idlesign]]></steamID>\n'
+        '\t<games>%s\n\t</games>\n</gamesList>' % ''.join(GAME % {'appid': idx} for idx in range(games_count))
+    ).encode('utf-8')
+
+
+def run(title, func):
+    tracemalloc.start()
+    started = perf_counter()
+
+    games = func()
+
+    elapsed = perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print('%-10s %6d games in %.3f s, peak memory %6.1f MB' % (title, len(games), elapsed, peak / 1024 / 1024))
+
+
+def main():
+    games_count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    profile = get_profile(games_count)
+
+    with StubServer(lambda path_: profile) as server:
+        client = HttpClient(limiter=RateLimiter({}))
+
+        url = user_module.URL_USER_GAMES_OWNED.replace(URL_COMMUNITY_BASE, server.url)
+        user_module.URL_USER_GAMES_OWNED = url
+
+        user = user_module.User('idlesign', client=client)
+
+        print('Profile size: %.1f MB' % (len(profile) / 1024 / 1024))
+
+        run('tree', lambda: user._get_games_from_xml(
+            DataFetcher(str_sub(url, username='idlesign'), client=client).fetch_xml()))
+
+        run('streaming', lambda: [game for game in user.iter_games_owned()])
+
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+"""Compares requests per second with and without HTTP connection pooling.
+
+    $ python benchmarks/bench_pooling.py [requests_count]
+
+"""
+import sys
+from os import path
+from time import perf_counter
+
+import requests
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from steampak.webapi.http import HttpClient, HEADERS_DEFAULT  # noqa
+from steampak.webapi.utils import DataFetcher  # noqa
+from _stub import StubServer  # noqa
+
+
+def run(title, func, count):
+    started = perf_counter()
+
+    for _ in range(count):
+        func()
+
+    elapsed = perf_counter() - started
+    print('%-12s %6d requests in %.3f s: %8.1f req/s' % (title, count, elapsed, count / elapsed))
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+
+    with StubServer() as server:
+        url = server.url + '/market/priceoverview/'
+
+        run('no pooling', lambda: requests.get(url, headers=HEADERS_DEFAULT).json(), count)
+
+        client = HttpClient()
+        run('pooling', lambda: DataFetcher(url, client=client).fetch_json(), count)
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -23,6 +23,7 @@ setup(
     author_email='idlesign@yandex.ru',
 
     packages=['steampak'],
+    python_requires='>=3.7',
     include_package_data=True,
     zip_safe=False,
 
@@ -32,6 +33,7 @@ setup(
     extras_require={
         'webapi': ['requests', 'bs4'],
         'extra': ['requests', 'bs4', 'click'],
+        'speedups': ['orjson'],
     },
 
     entry_points={
@@ -44,7 +46,7 @@ setup(
         'Operating System :: OS Independent',
         'Programming Language :: Python',
         'Programming Language :: Python :: 3',
-        'Programming Language :: Python :: 3.6',
+        'Programming Language :: Python :: 3.7',
         'License :: OSI Approved :: BSD License'
     ],
 )
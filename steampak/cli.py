@@ -1,13 +1,21 @@
 import click
+import csv
+import json
+from io import StringIO
+from os import path
 from operator import itemgetter
 from functools import partial
 from collections import defaultdict
+from time import monotonic
 
 from steampak import VERSION
 from .webapi.settings import CURRENCIES, CURRENCY_RUB
+from .webapi.metrics import MetricsRegistry, phases, PHASE_PARSE_HTML, PHASE_NORMALIZE_PRICES, PHASE_OUTPUT
 from .webapi.resources.user import User
 from .webapi.resources.apps import Application
 from .webapi.resources.market import Item, TAG_ITEM_CLASS_BOOSTER, TAG_ITEM_CLASS_CARD
+from .webapi.cache import FileCache
+from .webapi.http import HttpClient, set_client, deadline
 
 
 opt_currency = partial(
@@ -15,14 +23,146 @@ opt_currency = partial(
     help='Currency ISO code. Default: %s. Variants: %s. ' % (CURRENCIES[CURRENCY_RUB], ', '.join(CURRENCIES.values())),
     default=CURRENCIES[CURRENCY_RUB])
 
+opt_workers = partial(
+    click.option, '--workers',
+    help='Number of prices to fetch concurrently (within Web API rate limits).',
+    default=4, show_default=True, type=click.IntRange(min=1))
 
-def print_card_prices(appid, currency, detailed=True, owned_cards=None, skip_owned=False, foil=False):
 
+FORMAT_TEXT = 'text'
+FORMAT_JSONL = 'jsonl'
+FORMAT_CSV = 'csv'
+
+opt_format = partial(
+    click.option, '--format', 'fmt',
+    help='Output format. Machine-readable formats stream one record per line '
+         '(as soon as it is available) with totals as the final record.',
+    type=click.Choice([FORMAT_TEXT, FORMAT_JSONL, FORMAT_CSV]), default=FORMAT_TEXT, show_default=True)
+
+FIELDS_PRICES = [
+    'record', 'appid', 'app', 'card', 'market_hash', 'price', 'currency', 'owned',
+    'cards_total', 'cards_owned', 'price_owned', 'price_wanted', 'price_avg1', 'price_avg3', 'booster_price', 'apps']
+
+FIELDS_GAMES = ['record', 'appid', 'title', 'games']
+
+
+class RecordWriter(object):
+    """Writes records to stdout one per line (JSON Lines or CSV)."""
+
+    def __init__(self, fmt, fields):
+        """
+        :param str fmt: Output format: `jsonl` or `csv`.
+        :param list fields: Fields of all record types (CSV columns).
+        """
+        self.fmt = fmt
+        self.fields = fields
+
+        if fmt == FORMAT_CSV:
+            self._write_line(fields)
+
+    @classmethod
+    def get(cls, fmt, fields):
+        """Returns record writer for machine-readable format or None for text.
+
+        :param str fmt:
+        :param list fields:
+        :rtype: RecordWriter|None
+        """
+        if fmt == FORMAT_TEXT:
+            return None
+
+        return cls(fmt, fields)
+
+    def _write_line(self, values):
+        line = StringIO()
+        csv.writer(line, lineterminator='\n').writerow(values)
+        echo(line.getvalue(), nl=False)
+
+    def write(self, record, **fields):
+        """Writes a record.
+
+        :param str record: Record type, e.g. `card`, `total`.
+        :param fields: Record fields.
+        """
+        fields['record'] = record
+
+        if self.fmt == FORMAT_CSV:
+            self._write_line(['' if fields.get(field) is None else fields[field] for field in self.fields])
+
+        else:
+            echo(json.dumps(
+                {field: fields[field] for field in self.fields if field in fields},
+                default=str, ensure_ascii=False))
+
+
+def echo(*args, **kwargs):
+    with phases.measure(PHASE_OUTPUT):
+        click.echo(*args, **kwargs)
+
+
+def secho(*args, **kwargs):
+    with phases.measure(PHASE_OUTPUT):
+        click.secho(*args, **kwargs)
+
+
+def print_stats(metrics, started):
+    """Prints out timings per phase and requests counts per endpoint (to stderr).
+
+    :param MetricsRegistry metrics:
+    :param float started: Monotonic time the command was started at.
+    """
+    endpoints = [(endpoint, metrics.get(endpoint)) for endpoint in metrics.endpoints]
+
+    def get_sum(histogram):
+        return sum(getattr(endpoint_metrics, histogram).sum for _, endpoint_metrics in endpoints)
+
+    lines = [
+        'Stats',
+        '* Wall time: %.3fs' % (monotonic() - started),
+        '* Phases (summed over threads):',
+    ]
+
+    for title, seconds in (
+        ('rate limit wait', get_sum('wait_time')),
+        ('network', get_sum('network_time')),
+        ('parse json/xml', get_sum('parse_time')),
+        ('parse html', phases.get(PHASE_PARSE_HTML)[0]),
+        ('normalize prices', phases.get(PHASE_NORMALIZE_PRICES)[0]),
+        ('output', phases.get(PHASE_OUTPUT)[0]),
+    ):
+        lines.append('  %-18s %.3fs' % (title, seconds))
+
+    lines.append('* Requests:')
+
+    for endpoint, endpoint_metrics in endpoints:
+        p95 = endpoint_metrics.network_time.get_percentile(95)
+        lines.append(
+            '  %-16s fetches: %d, requests: %d, cached: %d, throttled: %d, errors: %d, network p95: <=%ss' % (
+                endpoint, endpoint_metrics.fetches, endpoint_metrics.requests, endpoint_metrics.cached,
+                endpoint_metrics.throttled, endpoint_metrics.errors, '-' if p95 is None else p95))
+
+    click.secho('\n'.join(lines), fg='cyan', err=True)
+
+
+def print_card_prices(
+        app, currency, detailed=True, owned_cards=None, skip_owned=False, foil=False, workers=1, writer=None):
+    """Prints out card prices for an application.
+
+    If record writer is given, records are written instead of text:
+    one per card as soon as it's priced and a summary for the application.
+
+    Returns application summary or None if application has no cards.
+
+    :rtype: dict|None
+    """
     owned_cards = owned_cards or []
 
-    app = Application(appid)
+    if not isinstance(app, Application):
+        app = Application(app)
+
+    appid = app.appid
 
-    click.secho('Card prices for `%s` [appid: %s]' % (app.title, appid), fg='green')
+    writer or secho('Card prices for `%s` [appid: %s]' % (app.title, appid), fg='green')
 
     cardborder_normal = True
     cardborder_foil = False
@@ -36,23 +176,35 @@ def print_card_prices(appid, currency, detailed=True, owned_cards=None, skip_own
     price_cards_wanted = 0
     count_cards_total = len(cards)
     prices = []
+    price_currency = None
 
     if not count_cards_total:
-        click.secho('This app has no cards.', fg='red', err=True)
-        return
+        secho('This app has no cards.', fg='red', err=True)
+        return None
 
     def get_line(card):
-        card.get_price_data(currency)
         return '%s: %s %s' % (card.title, card.price_lowest, card.price_currency)
 
-    for card in cards.values():
+    cards = [
+        card for card in cards.values()
+        if not (skip_owned and card.title in owned_cards)]
 
-        is_owned = card.title in owned_cards
+    if booster:
+        cards.append(booster)
+
+    for card in Item.iter_prices(cards, currency, workers=workers):
 
-        if is_owned and skip_owned:
+        if card is booster:
             continue
 
-        if detailed:
+        is_owned = card.title in owned_cards
+
+        if writer:
+            writer.write(
+                'card', appid=appid, app=app.title, card=card.title, market_hash=card.market_hash,
+                price=card.price_lowest, currency=card.price_currency, owned=is_owned)
+
+        elif detailed:
             prefix = ''
             fg = None
 
@@ -63,9 +215,10 @@ def print_card_prices(appid, currency, detailed=True, owned_cards=None, skip_own
             elif owned_cards:
                 prefix = 'WANTED - '
 
-            click.secho('%s%s' % (prefix, get_line(card)), fg=fg)
+            secho('%s%s' % (prefix, get_line(card)), fg=fg)
 
         price = card.price_lowest
+        price_currency = card.price_currency
         prices.append(price)
 
         if is_owned:
@@ -76,27 +229,106 @@ def print_card_prices(appid, currency, detailed=True, owned_cards=None, skip_own
     price_1avg = round(sum(prices) / count_cards_total, 2)
     price_3avg = price_1avg * 3
 
-    click.secho('* Total cards: %d' % count_cards_total, fg='green')
+    summary = {
+        'appid': appid,
+        'app': app.title,
+        'cards_total': count_cards_total,
+        'cards_owned': len(owned_cards) if owned_cards and not skip_owned else None,
+        'price_owned': price_cards_owned if owned_cards and not skip_owned else None,
+        'price_wanted': price_cards_wanted,
+        'price_avg1': price_1avg,
+        'price_avg3': price_3avg,
+        'booster_price': booster.price_lowest if booster else None,
+        'currency': price_currency,
+    }
+
+    if writer:
+        writer.write('app', **summary)
+        return summary
+
+    secho('* Total cards: %d' % count_cards_total, fg='green')
 
     if owned_cards and not skip_owned:
-        click.secho('* Owned cards: %d' % len(owned_cards), fg='green')
-        click.secho('* Price cards owned: %s' % price_cards_owned, fg='blue')
+        secho('* Owned cards: %d' % len(owned_cards), fg='green')
+        secho('* Price cards owned: %s' % price_cards_owned, fg='blue')
 
-    click.secho('* Price cards wanted: %s' % price_cards_wanted, fg='blue')
+    secho('* Price cards wanted: %s' % price_cards_wanted, fg='blue')
 
-    click.secho('* Price avg 1 card: %s' % price_1avg, fg='blue')
-    click.secho('* Price avg 3 cards: %s' % price_3avg, fg='blue')
+    secho('* Price avg 1 card: %s' % price_1avg, fg='blue')
+    secho('* Price avg 3 cards: %s' % price_3avg, fg='blue')
 
     if booster:
-        click.secho('* Booster price: %s' % get_line(booster), fg='yellow')
+        secho('* Booster price: %s' % get_line(booster), fg='yellow')
+
+    echo('%s\n' % ('=' * 20))
+
+    return summary
+
+
+def write_prices_total(writer, summaries):
+    """Writes totals for applications summaries (see `print_card_prices()`) as the final record.
+
+    :param RecordWriter writer:
+    :param list summaries:
+    """
+    summaries = [summary for summary in summaries if summary]
+    prices_owned = [summary['price_owned'] for summary in summaries if summary['price_owned'] is not None]
 
-    click.echo('%s\n' % ('=' * 20))
+    writer.write(
+        'total',
+        apps=len(summaries),
+        cards_total=sum(summary['cards_total'] for summary in summaries),
+        price_wanted=sum(summary['price_wanted'] for summary in summaries),
+        price_owned=sum(prices_owned) if prices_owned else None)
 
 
 @click.group()
 @click.version_option(version='.'.join(map(str, VERSION)))
-def start():
+@click.option(
+    '--cache-dir', help='Directory to cache Web API responses in.',
+    default=path.join(path.expanduser('~'), '.cache', 'steampak'), show_default=True)
+@click.option('--no-cache', help='Do not cache Web API responses.', is_flag=True)
+@click.option(
+    '--timeout', help='Seconds given to a command to complete all its Web API requests.',
+    type=click.FloatRange(min=0, min_open=True))
+@click.option('--stats', help='Print out timings and requests counts at exit (to stderr).', is_flag=True)
+@click.option(
+    '--profile', help='Profile the command (main thread) and save stats for `pstats` into the given file.',
+    type=click.Path(dir_okay=False, writable=True))
+@click.pass_context
+def start(ctx, cache_dir, no_cache, timeout, stats, profile):
     """Steampak command line utilities."""
+    hooks = []
+
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+
+        def dump_profile():
+            profiler.disable()
+            profiler.dump_stats(profile)
+            click.secho('Profile saved into %s' % profile, fg='cyan', err=True)
+
+        ctx.call_on_close(dump_profile)
+        profiler.enable()
+
+    if stats:
+        metrics = MetricsRegistry()
+        hooks.append(metrics)
+
+        phases.reset()
+        phases.enabled = True
+        started = monotonic()
+
+        def finish_stats():
+            phases.enabled = False
+            print_stats(metrics, started)
+
+        ctx.call_on_close(finish_stats)
+
+    set_client(HttpClient(cache=None if no_cache else FileCache(cache_dir), hooks=hooks))
+    ctx.with_resource(deadline(timeout))
 
 
 @start.group()
@@ -125,7 +357,7 @@ def get_price(ctx, currency):
     item_ = Item(appid, title)
     item_.get_price_data(currency)
 
-    click.secho('Lowest price: %s %s' % (item_.price_lowest, item_.price_currency), fg='green')
+    secho('Lowest price: %s %s' % (item_.price_lowest, item_.price_currency), fg='green')
 
 
 @start.group()
@@ -144,10 +376,10 @@ def get_cards(ctx):
     appid = ctx.obj['appid']
     app = Application(appid)
 
-    click.secho('Cards for `%s` [appid: %s]' % (app.title, appid), fg='green')
+    secho('Cards for `%s` [appid: %s]' % (app.title, appid), fg='green')
 
     if not app.has_cards:
-        click.secho('This app has no cards.', fg='red', err=True)
+        secho('This app has no cards.', fg='red', err=True)
         return
 
     cards, booster = app.get_cards()
@@ -156,18 +388,20 @@ def get_cards(ctx):
         return '%s [market hash: `%s`]' % (card.title, card.market_hash)
 
     for card in cards.values():
-        click.echo(get_line(card))
+        echo(get_line(card))
 
     if booster:
-        click.secho('* Booster pack: `%s`' % get_line(booster), fg='yellow')
+        secho('* Booster pack: `%s`' % get_line(booster), fg='yellow')
 
-    click.secho('* Total cards: %d' % len(cards), fg='green')
+    secho('* Total cards: %d' % len(cards), fg='green')
 
 
 @app.command()
 @opt_currency()
+@opt_workers()
+@opt_format()
 @click.pass_context
-def get_card_prices(ctx, currency):
+def get_card_prices(ctx, currency, workers, fmt):
     """Prints out lowest card prices for an application.
     Comma-separated list of application IDs is supported.
 
@@ -181,9 +415,17 @@ def get_card_prices(ctx, currency):
         appids = [appid.strip() for appid in appid.split(',')]
         detailed = False
 
-    for appid in appids:
-        print_card_prices(appid, currency, detailed=detailed)
-        click.echo('')
+    apps = [Application(appid) for appid in appids]
+    Application.prefetch(apps)
+
+    writer = RecordWriter.get(fmt, FIELDS_PRICES)
+    summaries = []
+
+    for app in apps:
+        summaries.append(print_card_prices(app, currency, detailed=detailed, workers=workers, writer=writer))
+        writer or echo('')
+
+    writer and write_prices_total(writer, summaries)
 
 
 @start.group()
@@ -200,68 +442,79 @@ def get_gems(ctx):
     """Prints out total gems count for a Steam user."""
 
     username = ctx.obj['username']
-    click.secho(
+    secho(
         'Total gems owned by `%s`: %d' % (username, User(username).gems_total),
         fg='green')
 
 
 @user.command()
+@opt_format()
 @click.pass_context
-def get_games(ctx):
+def get_games(ctx, fmt):
     """Prints out games owned by a Steam user."""
 
     username = ctx.obj['username']
+    writer = RecordWriter.get(fmt, FIELDS_GAMES)
+
+    if writer:
+        count = 0
+
+        # Streamed in the order games are parsed.
+        for appid, title in User(username).iter_games_owned():
+            writer.write('game', appid=appid, title=title)
+            count += 1
+
+        writer.write('total', games=count)
+        return
+
     games = User(username).get_games_owned()
 
     for game in sorted(games.values(), key=itemgetter('title')):
-        click.echo('%s [appid: %s]' % (game['title'], game['appid']))
+        echo('%s [appid: %s]' % (game['title'], game['appid']))
 
-    click.secho('Total gems owned by `%s`: %d' % (username, len(games)), fg='green')
+    secho('Total gems owned by `%s`: %d' % (username, len(games)), fg='green')
 
 
 @user.command()
 @opt_currency()
+@opt_workers()
+@opt_format()
 @click.pass_context
-def get_booster_stats(ctx, currency):
+def get_booster_stats(ctx, currency, workers, fmt):
     """Prints out price stats for booster packs available in Steam user inventory."""
 
     username = ctx.obj['username']
 
-    inventory = User(username)._get_inventory_raw()
     boosters = {}
-    for item in inventory['rgDescriptions'].values():
-
-        is_booster = False
-        tags = item['tags']
-        for tag in tags:
-            if tag['internal_name'] == TAG_ITEM_CLASS_BOOSTER:
-                is_booster = True
-                break
-
-        if not is_booster:
-            continue
-
-        appid = item['market_fee_app']
-        title = item['name']
-
-        boosters[appid] = title
+    for cls in User(username).inventory.filter(item_class=TAG_ITEM_CLASS_BOOSTER):
+        boosters[cls.appid] = cls.name
 
     if not boosters:
-        click.secho('User `%s` has no booster packs' % username, fg='red', err=True)
+        secho('User `%s` has no booster packs' % username, fg='red', err=True)
         return
 
+    apps = {appid: Application(appid) for appid in boosters}
+    Application.prefetch(apps.values())
+
+    writer = RecordWriter.get(fmt, FIELDS_PRICES)
+    summaries = []
+
     for appid, title in boosters.items():
-        click.secho('Found booster: `%s`' % title, fg='blue')
-        print_card_prices(appid, currency)
+        writer or secho('Found booster: `%s`' % title, fg='blue')
+        summaries.append(print_card_prices(apps[appid], currency, workers=workers, writer=writer))
+
+    writer and write_prices_total(writer, summaries)
 
 
 @user.command()
 @opt_currency()
+@opt_workers()
 @click.option('--appid', help='Allows getting stats only for certain applications.', multiple=True)
 @click.option('--skip-owned', help='Do not get prices for cards already owned.', is_flag=True)
 @click.option('--foil', help='Get stats for foil cards.', is_flag=True)
+@opt_format()
 @click.pass_context
-def get_cards_stats(ctx, currency, skip_owned, appid, foil):
+def get_cards_stats(ctx, currency, workers, skip_owned, appid, foil, fmt):
     """Prints out price stats for cards available in Steam user inventory."""
 
     username = ctx.obj['username']
@@ -274,17 +527,26 @@ def get_cards_stats(ctx, currency, skip_owned, appid, foil):
             cards_by_app[appid_].append(item)
 
     if not cards_by_app:
-        click.secho('User `%s` has no cards' % username, fg='red', err=True)
+        secho('User `%s` has no cards' % username, fg='red', err=True)
         return
 
+    Application.prefetch(cards[0].app for cards in cards_by_app.values())
+
+    writer = RecordWriter.get(fmt, FIELDS_PRICES)
+    summaries = []
+
     for appid_, cards in cards_by_app.items():
         app = cards[0].app
-        print_card_prices(
-            app.appid, currency,
+        summaries.append(print_card_prices(
+            app, currency,
             owned_cards=[card.title for card in cards],
             skip_owned=skip_owned,
             foil=foil,
-        )
+            workers=workers,
+            writer=writer,
+        ))
+
+    writer and write_prices_total(writer, summaries)
 
 
 def main():
@@ -0,0 +1,300 @@
+import json
+import logging
+import os
+import zlib
+from collections import OrderedDict, namedtuple
+from hashlib import sha1
+from struct import Struct, error as struct_error
+from tempfile import mkstemp
+from threading import Lock
+from time import time
+
+from .settings import CACHE_SIZE_MAX
+
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CacheEntry(namedtuple('CacheEntry', ['content', 'expires', 'validators'])):
+    """Cached response contents along with expiration timestamp
+    and validators (`ETag`, `Last-Modified` response headers)
+    allowing to revalidate expired contents with a conditional request.
+
+    """
+
+    __slots__ = ()
+
+    @property
+    def expired(self):
+        return self.expires < time()
+
+
+class ResponseCache(object):
+    """Base class for response caches.
+
+    Caches store raw response contents (bytes) under string keys.
+
+    Expired contents having validators are kept (till evicted),
+    so that they could be revalidated instead of being downloaded again.
+
+    """
+
+    def get(self, key):
+        """Returns cached content or None if not cached or expired.
+
+        :param str key:
+        :rtype: bytes|None
+        """
+        entry = self.get_entry(key)
+
+        if entry is None or entry.expired:
+            return None
+
+        return entry.content
+
+    def get_entry(self, key):
+        """Returns cache entry (possibly expired, if it has validators)
+        or None if not cached.
+
+        :param str key:
+        :rtype: CacheEntry|None
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def set(self, key, content, ttl, validators=None):
+        """Puts content into cache.
+
+        :param str key:
+        :param bytes content:
+        :param int ttl: Time to live in seconds.
+        :param dict validators: Response validators headers.
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def delete(self, key):
+        """Removes content from cache.
+
+        :param str key:
+        """
+        raise NotImplementedError  # pragma: nocover
+
+    def clear(self):
+        """Removes all contents from cache."""
+        raise NotImplementedError  # pragma: nocover
+
+
+class MemoryCache(ResponseCache):
+    """In-process cache evicting least recently used contents
+    when size limit is exceeded.
+
+    """
+
+    def __init__(self, size_max=CACHE_SIZE_MAX):
+        """
+        :param int size_max: Maximum size of contents in bytes.
+        """
+        self.size_max = size_max
+        self.size = 0
+
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def get_entry(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+
+            if entry is None:
+                return None
+
+            if entry.expired and not entry.validators:
+                self._pop(key)
+                return None
+
+            self._entries.move_to_end(key)
+
+            return entry
+
+    def set(self, key, content, ttl, validators=None):
+        with self._lock:
+            self._pop(key)
+            self._entries[key] = CacheEntry(content, time() + ttl, validators or {})
+            self.size += len(content)
+
+            while self.size > self.size_max and self._entries:
+                self._pop(next(iter(self._entries)))
+
+    def _pop(self, key):
+        entry = self._entries.pop(key, None)
+
+        if entry is not None:
+            self.size -= len(entry.content)
+
+    def delete(self, key):
+        with self._lock:
+            self._pop(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+
+class FileCache(ResponseCache):
+    """Cache keeping compressed contents in files within a directory.
+
+    Least recently used files are removed when size limit is exceeded.
+
+    """
+
+    header = Struct('!dH')  # Expiration timestamp, validators length.
+
+    def __init__(self, path, size_max=CACHE_SIZE_MAX):
+        """
+        :param str path: Cache directory path. Created if not exists.
+        :param int size_max: Maximum size of cache files in bytes.
+        """
+        self.path = path
+        self.size_max = size_max
+        self.size = 0
+
+        self.enabled = True
+        """False if cache directory is not usable. Caching is off in this case."""
+
+        self._lock = Lock()
+
+        try:
+            os.makedirs(path, exist_ok=True)
+            self.size = self._get_size()
+
+        except OSError as e:
+            LOGGER.warning('Cache directory %s is not usable, caching is off: %s', path, e)
+            self.enabled = False
+
+    def _get_files(self):
+        with os.scandir(self.path) as entries:
+            return [entry for entry in entries if entry.is_file() and entry.name.endswith('.cache')]
+
+    def _get_size(self):
+        return sum(entry.stat().st_size for entry in self._get_files())
+
+    def _get_filepath(self, key):
+        return os.path.join(self.path, '%s.cache' % sha1(key.encode('utf-8')).hexdigest())
+
+    def get_entry(self, key):
+        if not self.enabled:
+            return None
+
+        filepath = self._get_filepath(key)
+
+        try:
+            with open(filepath, 'rb') as f:
+                data = f.read()
+
+        except OSError:
+            return None
+
+        header = self.header
+
+        try:
+            expires, validators_len = header.unpack_from(data)
+            offset = header.size + validators_len
+            validators = json.loads(data[header.size:offset]) if validators_len else {}
+
+        except (struct_error, ValueError):  # Unknown format.
+            self.delete(key)
+            return None
+
+        if expires < time() and not validators:
+            self.delete(key)
+            return None
+
+        try:
+            os.utime(filepath)  # Mark as recently used.
+            return CacheEntry(zlib.decompress(data[offset:]), expires, validators)
+
+        except (OSError, zlib.error):
+            return None
+
+    def set(self, key, content, ttl, validators=None):
+        if not self.enabled:
+            return
+
+        filepath = self._get_filepath(key)
+
+        validators = json.dumps(validators).encode('utf-8') if validators else b''
+
+        data = self.header.pack(time() + ttl, len(validators)) + validators + zlib.compress(content)
+
+        filepath_tmp = None
+
+        try:
+            # Unique temporary file, so that concurrent writers do not clash.
+            fd, filepath_tmp = mkstemp(suffix='.tmp', dir=self.path)
+
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+
+            with self._lock:
+                size_old = self._get_filesize(filepath)
+                os.replace(filepath_tmp, filepath)
+                filepath_tmp = None
+                self.size += self._get_filesize(filepath) - size_old
+
+                if self.size > self.size_max:
+                    self._evict(keep=filepath)
+
+        except OSError as e:
+            LOGGER.warning('Unable to write cache file for %s: %s', key, e)
+
+            if filepath_tmp:
+                try:
+                    os.remove(filepath_tmp)
+
+                except OSError:
+                    pass
+
+    def _get_filesize(self, filepath):
+        try:
+            return os.path.getsize(filepath)
+
+        except OSError:
+            return 0
+
+    def _remove(self, filepath):
+        size = self._get_filesize(filepath)
+
+        try:
+            os.remove(filepath)
+
+        except OSError:
+            return 0
+
+        return size
+
+    def _evict(self, keep):
+        # Drop least recently used files until cache is 10% below the limit.
+        files = sorted(self._get_files(), key=lambda entry: entry.stat().st_mtime)
+        size = sum(entry.stat().st_size for entry in files)
+        size_target = self.size_max * 0.9
+
+        for entry in files:
+            if size <= size_target:
+                break
+
+            if entry.path != keep:
+                size -= self._remove(entry.path)
+
+        self.size = size
+
+    def delete(self, key):
+        with self._lock:
+            self.size -= self._remove(self._get_filepath(key))
+
+    def clear(self):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            for entry in self._get_files():
+                self._remove(entry.path)
+            self.size = 0
@@ -14,3 +14,24 @@ class ResponseError(SteamWebApiError):
 
     def __str__(self):
         return self.description
+
+
+class TooManyRequests(ResponseError):
+    """Exception generated when server keeps responding
+    with `429 Too Many Requests` after all retries.
+
+    """
+
+
+class RequestTimeout(ResponseError):
+    """Exception generated when server doesn't respond
+    in time (connect or read timeout).
+
+    """
+
+
+class DeadlineExceeded(RequestTimeout):
+    """Exception generated when an operation deadline
+    is exceeded (see `steampak.webapi.http.deadline()`).
+
+    """
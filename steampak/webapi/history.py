@@ -0,0 +1,113 @@
+import sqlite3
+from collections import namedtuple
+from decimal import Decimal
+from threading import Lock
+from time import time
+
+
+PricePoint = namedtuple('PricePoint', ['timestamp', 'lowest_price', 'median_price', 'volume'])
+"""Market item price at a moment."""
+
+
+class PriceHistory(object):
+    """Append-only market prices history kept in SQLite database.
+
+    Prices are indexed by market hash, currency and time,
+    so that range and last price queries do not scan the whole history.
+
+    """
+
+    def __init__(self, path=':memory:'):
+        """
+        :param str path: Database file path. In-memory database is used by default.
+        """
+        self.path = path
+
+        self._lock = Lock()
+        self._connection = connection = sqlite3.connect(path, check_same_thread=False)
+
+        with connection:
+            if path != ':memory:':
+                connection.execute('PRAGMA journal_mode=WAL')
+
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS prices ('
+                'market_hash TEXT NOT NULL, currency TEXT NOT NULL, timestamp REAL NOT NULL, '
+                'lowest_price TEXT NOT NULL, median_price TEXT NOT NULL, volume TEXT NOT NULL)')
+
+            connection.execute(
+                'CREATE INDEX IF NOT EXISTS prices_lookup ON prices (market_hash, currency, timestamp)')
+
+    def close(self):
+        """Closes database connection."""
+        self._connection.close()
+
+    @classmethod
+    def _get_point(cls, row):
+        timestamp, lowest_price, median_price, volume = row
+        return PricePoint(timestamp, Decimal(lowest_price), Decimal(median_price), Decimal(volume))
+
+    def append(self, market_hash, price_data, timestamp=None):
+        """Appends price data (as returned by `Item.get_price_data()`) to history.
+
+        :param str market_hash:
+        :param dict price_data:
+        :param float timestamp: Defaults to current time.
+        """
+        self.append_many([(market_hash, price_data)], timestamp=timestamp)
+
+    def append_many(self, prices, timestamp=None):
+        """Appends many prices at once.
+
+        :param Iterable[tuple] prices: (market_hash, price_data) tuples.
+        :param float timestamp: Defaults to current time.
+        """
+        timestamp = timestamp or time()
+
+        rows = [
+            (
+                market_hash, price_data['currency'], timestamp,
+                str(price_data['lowest_price']), str(price_data['median_price']), str(price_data['volume']))
+            for market_hash, price_data in prices if price_data]
+
+        with self._lock, self._connection as connection:
+            connection.executemany('INSERT INTO prices VALUES (?, ?, ?, ?, ?, ?)', rows)
+
+    def get_range(self, market_hash, currency, since=None, until=None):
+        """Returns prices recorded within the given time range (oldest first).
+
+        :param str market_hash:
+        :param str currency: Currency ISO code.
+        :param float since: Timestamp to start from (inclusive).
+        :param float until: Timestamp to end at (inclusive).
+        :rtype: list[PricePoint]
+        """
+        query = (
+            'SELECT timestamp, lowest_price, median_price, volume FROM prices '
+            'WHERE market_hash = ? AND currency = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp')
+
+        args = (market_hash, currency, since or 0, until or float('inf'))
+
+        with self._lock:
+            rows = self._connection.execute(query, args).fetchall()
+
+        return [self._get_point(row) for row in rows]
+
+    def get_last(self, market_hash, currency, max_age=None):
+        """Returns last known price or None if unknown or older than `max_age`.
+
+        :param str market_hash:
+        :param str currency: Currency ISO code.
+        :param float max_age: Maximum price age in seconds.
+        :rtype: PricePoint|None
+        """
+        query = (
+            'SELECT timestamp, lowest_price, median_price, volume FROM prices '
+            'WHERE market_hash = ? AND currency = ? AND timestamp >= ? ORDER BY timestamp DESC LIMIT 1')
+
+        args = (market_hash, currency, time() - max_age if max_age else 0)
+
+        with self._lock:
+            row = self._connection.execute(query, args).fetchone()
+
+        return row and self._get_point(row)
@@ -0,0 +1,684 @@
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, as_completed
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
+from email.utils import parsedate_to_datetime
+from random import uniform
+from threading import Lock
+from time import sleep, monotonic, time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .exceptions import DeadlineExceeded
+from .settings import (
+    RATE_LIMITS, RETRIES_MAX, CACHE_TTLS, RETRY_BACKOFF_BASE, RETRY_BACKOFF_MAX,
+    CACHE_PARSED_MAX, TIMEOUT_CONNECT, TIMEOUT_READ, HEDGE_ENDPOINTS)
+
+
+LOGGER = logging.getLogger(__name__)
+
+HEADERS_DEFAULT = {
+    'User-Agent': 'Valve/Steam HTTP Client 1.0 (tenfoot)',
+    'Connection': 'keep-alive',
+}
+
+
+# Monotonic time operations in the current context should be completed by.
+_DEADLINE = ContextVar('steampak_deadline', default=None)
+
+
+@contextmanager
+def deadline(seconds):
+    """Sets a deadline for all Web API requests made within the block,
+    including those made in executor threads (see `submit()`).
+
+    When the deadline is exceeded `DeadlineExceeded` is raised.
+    Nested deadlines may only shorten outer ones.
+
+    .. code-block:: python
+
+        with deadline(60):
+            cards, booster = Application(appid).get_cards()
+
+    :param float seconds: Seconds given to the operation. None for no deadline.
+    """
+    if seconds is None:
+        yield
+        return
+
+    till = monotonic() + seconds
+    till_outer = _DEADLINE.get()
+
+    if till_outer is not None:
+        till = min(till, till_outer)
+
+    token = _DEADLINE.set(till)
+
+    try:
+        yield
+
+    finally:
+        _DEADLINE.reset(token)
+
+
+def get_time_left():
+    """Returns seconds left till the current deadline (see `deadline()`)
+    or None if there is no deadline.
+
+    :rtype: float|None
+    """
+    till = _DEADLINE.get()
+
+    if till is None:
+        return None
+
+    return till - monotonic()
+
+
+def check_deadline(url=''):
+    """Raises `DeadlineExceeded` if the current deadline is exceeded.
+    Returns seconds left or None if there is no deadline.
+
+    :param str url: URL being fetched, to be put into exception.
+    :rtype: float|None
+    """
+    time_left = get_time_left()
+
+    if time_left is not None and time_left <= 0:
+        raise DeadlineExceeded('Deadline exceeded', url)
+
+    return time_left
+
+
+def submit(executor, func, *args):
+    """Submits a callable to the executor to be run within a copy
+    of the current context, so that deadline (see `deadline()`) is respected.
+
+    :param concurrent.futures.Executor executor:
+    :param callable func:
+    :rtype: concurrent.futures.Future
+    """
+    return executor.submit(copy_context().run, func, *args)
+
+
+class RateLimiter(object):
+    """Thread-safe token bucket rate limiter keeping a bucket per host."""
+
+    def __init__(self, limits=None):
+        """
+        :param dict limits: Mapping of host names to (rate, burst) tuples,
+            where `rate` is requests per second and `burst` is bucket capacity.
+            Hosts not found in mapping are not limited. Defaults to `RATE_LIMITS` setting.
+        """
+        self.limits = dict(RATE_LIMITS if limits is None else limits)
+
+        self._buckets = {}
+        self._lock = Lock()
+
+    def _get_bucket(self, host):
+        bucket = self._buckets.get(host)
+
+        if bucket is None:
+            rate, burst = self.limits.get(host, (None, None))
+            # [tokens available, last update time, paused till time]
+            bucket = self._buckets[host] = [burst, monotonic(), 0]
+
+        return bucket
+
+    def reserve(self, host, timeout=None):
+        """Takes a token from host bucket and returns a number of seconds
+        to wait before the request can be made.
+
+        :param str host:
+        :param float timeout: Maximum seconds to wait. If a longer wait is required
+            the token is not taken (the wait is still returned).
+        :rtype: float
+        """
+        rate, burst = self.limits.get(host, (None, None))
+
+        with self._lock:
+            bucket = self._get_bucket(host)
+            now = monotonic()
+            tokens, updated, paused_till = bucket
+
+            wait = max(paused_till - now, 0)
+
+            if rate:
+                tokens = min(tokens + (now - updated) * rate, burst) - 1
+
+                if tokens < 0:
+                    wait = max(wait, -tokens / rate)
+
+            if timeout is not None and wait > timeout:
+                return wait
+
+            if rate:
+                bucket[0], bucket[1] = tokens, now
+
+            return wait
+
+    def acquire(self, host, timeout=None):
+        """Blocks until a request to the given host is allowed.
+
+        :param str host:
+        :param float timeout: Maximum seconds to wait. If a longer wait is required
+            `DeadlineExceeded` is raised at once (no token is taken).
+        """
+        wait = self.reserve(host, timeout)
+
+        if timeout is not None and wait > timeout:
+            raise DeadlineExceeded('Rate limit for %s requires waiting for %.2f seconds' % (host, wait), host)
+
+        if wait:
+            LOGGER.debug('Rate limit for %s. Waiting for %.2f seconds ...', host, wait)
+            sleep(wait)
+
+    def try_acquire(self, host):
+        """Takes a token from host bucket only if a request
+        to the given host is allowed right away.
+
+        :param str host:
+        :rtype: bool
+        """
+        rate, burst = self.limits.get(host, (None, None))
+
+        with self._lock:
+            bucket = self._get_bucket(host)
+            now = monotonic()
+            tokens, updated, paused_till = bucket
+
+            if paused_till > now:
+                return False
+
+            if not rate:
+                return True
+
+            tokens = min(tokens + (now - updated) * rate, burst)
+
+            if tokens < 1:
+                return False
+
+            bucket[0], bucket[1] = tokens - 1, now
+
+            return True
+
+    def pause(self, host, seconds):
+        """Suspends requests to the given host for a number of seconds.
+
+        :param str host:
+        :param float seconds:
+        """
+        with self._lock:
+            bucket = self._get_bucket(host)
+            bucket[2] = max(bucket[2], monotonic() + seconds)
+
+
+class LatencyTracker(object):
+    """Thread-safe tracker of recent requests latencies per endpoint."""
+
+    def __init__(self, window=200):
+        """
+        :param int window: Number of recent latencies kept per endpoint.
+        """
+        self.window = window
+
+        self._latencies = {}
+        self._lock = Lock()
+
+    def add(self, endpoint, seconds):
+        """Registers request latency.
+
+        :param str endpoint:
+        :param float seconds:
+        """
+        with self._lock:
+            latencies = self._latencies.get(endpoint)
+
+            if latencies is None:
+                latencies = self._latencies[endpoint] = deque(maxlen=self.window)
+
+            latencies.append(seconds)
+
+    def get_count(self, endpoint):
+        """Returns a number of latencies known for endpoint.
+
+        :param str endpoint:
+        :rtype: int
+        """
+        return len(self._latencies.get(endpoint) or ())
+
+    def get_percentile(self, endpoint, percentile):
+        """Returns latency percentile for endpoint
+        or None if no latencies are known.
+
+        :param str endpoint:
+        :param float percentile: E.g. 95 for the latency 95% of requests were answered in.
+        :rtype: float|None
+        """
+        with self._lock:
+            latencies = sorted(self._latencies.get(endpoint) or ())
+
+        if not latencies:
+            return None
+
+        idx = max(int(round(percentile / 100 * len(latencies))) - 1, 0)
+
+        return latencies[min(idx, len(latencies) - 1)]
+
+
+class HedgePolicy(object):
+    """Hedged requests policy.
+
+    If a request to an endpoint isn't answered in time most of recent
+    requests to that endpoint were answered in (see `percentile`),
+    an identical request is fired (if rate limits allow)
+    and whichever is answered first is used.
+
+    """
+
+    def __init__(self, endpoints=HEDGE_ENDPOINTS, percentile=95, delay_min=0.05, samples_min=20):
+        """
+        :param Iterable[str] endpoints: Names of endpoints to hedge requests to.
+        :param float percentile: Latency percentile to fire a hedge request after.
+        :param float delay_min: Minimum seconds to wait before hedging.
+        :param int samples_min: Minimum number of latencies known for endpoint
+            for its requests to be hedged.
+        """
+        self.endpoints = set(endpoints)
+        self.percentile = percentile
+        self.delay_min = delay_min
+        self.samples_min = samples_min
+
+    def get_delay(self, endpoint, latencies):
+        """Returns seconds to wait before hedging
+        a request to endpoint or None if not to hedge.
+
+        :param str endpoint:
+        :param LatencyTracker latencies:
+        :rtype: float|None
+        """
+        if endpoint not in self.endpoints or latencies.get_count(endpoint) < self.samples_min:
+            return None
+
+        return max(latencies.get_percentile(endpoint, self.percentile), self.delay_min)
+
+
+class SingleFlight(object):
+    """Coalesces identical concurrent calls: while a call for a key
+    is in progress, other callers for the same key wait for it
+    and get the same result (or exception) instead of doing the work again.
+
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = Lock()
+
+    def do(self, key, func, timeout=None):
+        """Calls `func` unless a call for the given key is already
+        in progress, in which case waits for its result.
+
+        :param key: Hashable call identifier.
+        :param callable func:
+        :param float timeout: Maximum seconds to wait for a call in progress.
+            `concurrent.futures.TimeoutError` is raised when exceeded.
+        """
+        with self._lock:
+            future = self._calls.get(key)
+            leader = future is None
+
+            if leader:
+                future = self._calls[key] = Future()
+
+        if not leader:
+            LOGGER.debug('Joining request in flight: %s', key)
+            return future.result(timeout)
+
+        try:
+            result = func()
+
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+
+        else:
+            future.set_result(result)
+            return result
+
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+class HttpClient(object):
+    """HTTP client holding a pooled keep-alive session.
+
+    A single client is meant to be shared by all Web API resources
+    (applications, market items, users), so that connections
+    to Steam hosts are reused instead of being opened for every request.
+
+    """
+
+    def __init__(
+            self, pool_size=10, pool_block=False, headers=None, concurrency=None,
+            limiter=None, retries=RETRIES_MAX, cache=None, cache_ttls=None, coalesce=True,
+            timeout=(TIMEOUT_CONNECT, TIMEOUT_READ), hedging=None, hooks=None):
+        """
+        :param int pool_size: Maximum number of connections kept alive per host.
+        :param bool pool_block: Whether to wait for a free connection
+            instead of opening an extra (not pooled) one when the pool is exhausted.
+        :param dict headers: Headers to send with every request (update defaults).
+        :param int concurrency: Maximum number of requests in flight
+            for asynchronous fetching. Defaults to pool size.
+        :param RateLimiter limiter: Rate limiter shared by all requests of this client.
+        :param int retries: Maximum retries for a request hitting `429 Too Many Requests`.
+        :param ResponseCache cache: Cache for responses. If not set responses are not cached.
+        :param dict cache_ttls: Mapping of endpoint names to cache time to live (seconds).
+            Defaults to `CACHE_TTLS` setting.
+        :param bool coalesce: Whether identical requests made concurrently
+            should share one network call and one parsed result.
+            Note that shared results must not be mutated by consumers.
+        :param tuple|float timeout: Connect and read timeouts in seconds
+            (a number to use for both). None to wait forever.
+        :param HedgePolicy hedging: Hedged requests policy. If not set requests are not hedged.
+        :param list hooks: Fetch hooks (see `metrics.FetchHook`) called around every fetch.
+        """
+        self.pool_size = pool_size
+        self.pool_block = pool_block
+        self.headers = dict(HEADERS_DEFAULT, **(headers or {}))
+        self.concurrency = concurrency or pool_size
+        self.limiter = limiter or RateLimiter()
+        self.retries = retries
+        self.cache = cache
+        self.cache_ttls = dict(CACHE_TTLS if cache_ttls is None else cache_ttls)
+        self.flights = SingleFlight() if coalesce else None
+        self.timeout = timeout
+        self.hedging = hedging
+        self.latencies = LatencyTracker()
+        self.hooks = list(hooks or [])
+
+        # Asynchronous fetches in flight indexed by (loop, kind, cache key).
+        self._flights_async = {}
+        # Parsed cached contents indexed by (kind, cache key): (validators, parsed).
+        self._parsed = OrderedDict()
+        self._parsed_lock = Lock()
+        self._session = None
+        self._executor = None
+        self._hedge_executor = None
+        self._lock = Lock()
+
+    def _get_session(self):
+        session = requests.Session()
+        session.headers.update(self.headers)
+
+        adapter = HTTPAdapter(
+            pool_connections=self.pool_size, pool_maxsize=self.pool_size, pool_block=self.pool_block)
+
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        return session
+
+    @property
+    def session(self):
+        """Lazily initialized session shared by all requests of this client.
+
+        :rtype: requests.Session
+        """
+        session = self._session
+
+        if session is None:
+            with self._lock:
+                session = self._session
+
+                if session is None:
+                    session = self._session = self._get_session()
+
+        return session
+
+    @property
+    def executor(self):
+        """Lazily initialized executor bounding the number of requests
+        performed concurrently for asynchronous fetchers.
+
+        :rtype: ThreadPoolExecutor
+        """
+        executor = self._executor
+
+        if executor is None:
+            with self._lock:
+                executor = self._executor
+
+                if executor is None:
+                    executor = self._executor = ThreadPoolExecutor(
+                        max_workers=self.concurrency, thread_name_prefix='steampak')
+
+        return executor
+
+    @property
+    def hedge_executor(self):
+        """Lazily initialized executor performing hedged requests.
+
+        :rtype: ThreadPoolExecutor
+        """
+        executor = self._hedge_executor
+
+        if executor is None:
+            with self._lock:
+                executor = self._hedge_executor
+
+                if executor is None:
+                    executor = self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=self.pool_size * 2, thread_name_prefix='steampak-hedge')
+
+        return executor
+
+    def fetch(self, url, params=None, endpoint=None, **kwargs):
+        """Performs GET request (see `get()`) tracking endpoint latency.
+
+        Request is hedged if hedging policy says so (see `HedgePolicy`).
+
+        :param str url:
+        :param dict params:
+        :param str endpoint: Endpoint name (see `ENDPOINT_` constants in settings).
+        :rtype: requests.Response
+        """
+        hedging = self.hedging
+        delay = None
+
+        if hedging is not None and not kwargs.get('stream'):
+            delay = hedging.get_delay(endpoint, self.latencies)
+
+        if delay is None:
+            return self._get_timed(url, params, endpoint, kwargs)
+
+        executor = self.hedge_executor
+        started = []
+
+        def get_primary():
+            started.append(monotonic())
+            return self._get_timed(url, params, endpoint, kwargs)
+
+        primary = submit(executor, get_primary)
+
+        # Delay is counted from the moment the primary request starts,
+        # not from the moment it is queued in executor.
+        wait = delay
+
+        while True:
+            try:
+                return primary.result(wait)
+
+            except FutureTimeoutError:
+                pass
+
+            if started:
+                wait = started[0] + delay - monotonic()
+
+                if wait <= 0:
+                    break
+
+        if not self.limiter.try_acquire(urlsplit(url).hostname):
+            LOGGER.debug('No rate limit budget to hedge request to %s', url)
+            return primary.result()
+
+        LOGGER.debug('Hedging request to %s not answered in %.3f seconds ...', url, delay)
+
+        pending = {primary, submit(executor, self._get_timed, url, params, endpoint, kwargs)}
+
+        for future in as_completed(list(pending)):
+            pending.discard(future)
+
+            if future.exception() is None or not pending:
+                break
+
+        for future_ in pending:
+            future_.add_done_callback(self._discard_response)
+
+        return future.result()
+
+    def _get_timed(self, url, params, endpoint, kwargs):
+        started = monotonic()
+        response = self.get(url, params, **kwargs)
+        endpoint and self.latencies.add(endpoint, monotonic() - started)
+        return response
+
+    @classmethod
+    def _discard_response(cls, future):
+        # Releases connection of a response not to be used (e.g. the one lost a hedge race).
+        if future.exception() is None:
+            future.result().close()
+
+    def get(self, url, params=None, **kwargs):
+        """Performs GET request using pooled session.
+
+        :param str url:
+        :param dict params:
+        :rtype: requests.Response
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.get(url, params=params, **kwargs)
+
+    def get_timeout(self, time_left=None):
+        """Returns (connect, read) timeouts for a request
+        shortened to fit into the time left till deadline.
+
+        :param float time_left:
+        :rtype: tuple|None
+        """
+        timeout = self.timeout
+
+        if time_left is None:
+            return timeout
+
+        if not isinstance(timeout, tuple):
+            timeout = (timeout, timeout)
+
+        return tuple(time_left if value is None else min(value, time_left) for value in timeout)
+
+    def get_parsed(self, key, validators):
+        """Returns previously parsed contents for the given key
+        if they were parsed from contents with the same validators.
+
+        :param tuple key: (kind, cache key)
+        :param dict validators:
+        """
+        with self._parsed_lock:
+            entry = self._parsed.get(key)
+
+            if entry is None or entry[0] != validators:
+                return None
+
+            self._parsed.move_to_end(key)
+
+            LOGGER.debug('Parsed data reused for %s', key[1])
+
+            return entry[1]
+
+    def set_parsed(self, key, validators, parsed):
+        """Remembers parsed contents (up to `CACHE_PARSED_MAX` recently used).
+
+        :param tuple key: (kind, cache key)
+        :param dict validators:
+        :param parsed:
+        """
+        with self._parsed_lock:
+            self._parsed[key] = (validators, parsed)
+            self._parsed.move_to_end(key)
+
+            while len(self._parsed) > CACHE_PARSED_MAX:
+                self._parsed.popitem(last=False)
+
+    @classmethod
+    def get_retry_pause(cls, response, attempt):
+        """Returns a number of seconds to wait before retrying
+        a request rejected with `429 Too Many Requests`.
+
+        Respects `Retry-After` header, otherwise uses exponential backoff with jitter.
+
+        :param requests.Response response:
+        :param int attempt: Retry attempt number (starting from 1).
+        :rtype: float
+        """
+        retry_after = response.headers.get('Retry-After')
+
+        if retry_after:
+            try:
+                return max(float(retry_after), 0)
+
+            except ValueError:
+                try:
+                    return max(parsedate_to_datetime(retry_after).timestamp() - time(), 0)
+
+                except (TypeError, ValueError):
+                    pass
+
+        return uniform(0, min(RETRY_BACKOFF_BASE * 2 ** attempt, RETRY_BACKOFF_MAX))
+
+    def close(self):
+        """Closes all pooled connections."""
+        with self._lock:
+            session, executors = self._session, (self._executor, self._hedge_executor)
+            self._session = self._executor = self._hedge_executor = None
+
+        for executor in executors:
+            if executor is not None:
+                executor.shutdown()
+
+        if session is not None:
+            session.close()
+
+
+_CLIENT_DEFAULT = None
+_CLIENT_LOCK = Lock()
+
+
+def get_client():
+    """Returns default HTTP client shared by Web API resources.
+
+    :rtype: HttpClient
+    """
+    global _CLIENT_DEFAULT
+
+    client = _CLIENT_DEFAULT
+
+    if client is None:
+        with _CLIENT_LOCK:
+            client = _CLIENT_DEFAULT
+
+            if client is None:
+                client = _CLIENT_DEFAULT = HttpClient()
+
+    return client
+
+
+def set_client(client):
+    """Sets default HTTP client shared by Web API resources.
+
+    :param HttpClient client:
+    """
+    global _CLIENT_DEFAULT
+    _CLIENT_DEFAULT = client
@@ -0,0 +1,326 @@
+from bisect import bisect_left
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic
+
+
+# Histogram buckets upper bounds (seconds).
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, float('inf'))
+
+ENDPOINT_OTHER = 'other'
+
+# Names of processing phases measured with `phases` timer.
+PHASE_PARSE_HTML = 'parse_html'
+PHASE_NORMALIZE_PRICES = 'normalize_prices'
+PHASE_OUTPUT = 'output'
+
+
+class FetchEvent(object):
+    """Information about a fetch passed to fetch hooks (see `FetchHook`)."""
+
+    __slots__ = [
+        'url', 'endpoint', 'kind', 'status', 'size', 'cached', 'revalidated',
+        'retries', 'throttled', 'wait_time', 'network_time', 'parse_time', 'duration', 'error']
+
+    def __init__(self, url, endpoint=None, kind='content'):
+        """
+        :param str url:
+        :param str endpoint: Endpoint name (see `ENDPOINT_` constants in settings).
+        :param str kind: Fetch kind: `data` (raw response), `content`, `stream`, `json`, `xml`.
+        """
+        self.url = url
+        self.endpoint = endpoint
+        self.kind = kind
+
+        self.status = None
+        """Response status code. None if no request has been made."""
+
+        self.size = 0
+        """Response contents size in bytes."""
+
+        self.cached = False
+        """Contents are taken from cache."""
+
+        self.revalidated = False
+        """Cached contents are revalidated with a conditional request."""
+
+        self.retries = 0
+        """Number of retried requests."""
+
+        self.throttled = 0
+        """Number of `429 Too Many Requests` responses."""
+
+        self.wait_time = 0
+        """Seconds spent waiting for rate limiter."""
+
+        self.network_time = 0
+        """Seconds spent on requests."""
+
+        self.parse_time = 0
+        """Seconds spent on parsing contents."""
+
+        self.duration = 0
+        """Overall fetch duration in seconds."""
+
+        self.error = None
+        """Exception raised during fetch, if any."""
+
+    def __repr__(self):
+        return '<FetchEvent %s %s %s>' % (self.endpoint, self.status, self.url)
+
+
+class FetchHook(object):
+    """Base class for fetch hooks.
+
+    Hooks are registered on HTTP client (see `HttpClient.hooks`)
+    and called around every fetch made with the client.
+
+    """
+
+    def fetch_started(self, event):
+        """Called before a fetch.
+
+        :param FetchEvent event:
+        """
+
+    def fetch_finished(self, event):
+        """Called after a fetch (successful or not).
+
+        :param FetchEvent event:
+        """
+
+
+class Histogram(object):
+    """Histogram with fixed buckets."""
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param tuple buckets: Buckets upper bounds in ascending order.
+        """
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0
+
+    def observe(self, value):
+        """Registers a value.
+
+        :param float value:
+        """
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def get_percentile(self, percentile):
+        """Returns an upper bound of a bucket holding the given percentile
+        or None if there are no values.
+
+        :param float percentile: E.g. 95.
+        :rtype: float|None
+        """
+        if not self.count:
+            return None
+
+        rank = percentile / 100 * self.count
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+
+            if total >= rank:
+                return bound
+
+        return self.buckets[-1]  # pragma: nocover
+
+    def as_dict(self):
+        """Returns histogram data: count, sum and cumulative counts per bucket bound.
+
+        :rtype: dict
+        """
+        cumulative = []
+        total = 0
+
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            cumulative.append((bound, total))
+
+        return {'count': self.count, 'sum': self.sum, 'buckets': cumulative}
+
+
+class EndpointMetrics(object):
+    """Metrics for requests to an endpoint."""
+
+    counters = ['fetches', 'requests', 'cached', 'revalidated', 'errors', 'retries', 'throttled', 'bytes']
+
+    def __init__(self):
+        for counter in self.counters:
+            setattr(self, counter, 0)
+
+        self.wait_time = Histogram()
+        self.network_time = Histogram()
+        self.parse_time = Histogram()
+        self.duration = Histogram()
+
+    def add(self, event):
+        """Registers a finished fetch.
+
+        :param FetchEvent event:
+        """
+        requested = event.status is not None
+
+        self.fetches += 1
+        self.requests += event.retries + 1 if requested else 0
+        self.cached += event.cached
+        self.revalidated += event.revalidated
+        self.errors += event.error is not None
+        self.retries += event.retries
+        self.throttled += event.throttled
+        self.bytes += event.size
+
+        if requested:
+            self.wait_time.observe(event.wait_time)
+            self.network_time.observe(event.network_time)
+
+        if event.parse_time:
+            self.parse_time.observe(event.parse_time)
+
+        self.duration.observe(event.duration)
+
+    def as_dict(self):
+        """
+        :rtype: dict
+        """
+        data = {counter: getattr(self, counter) for counter in self.counters}
+
+        for histogram in ('wait_time', 'network_time', 'parse_time', 'duration'):
+            data[histogram] = getattr(self, histogram).as_dict()
+
+        return data
+
+
+class MetricsRegistry(FetchHook):
+    """In-process registry of fetch metrics per endpoint: counters
+    and latency histograms.
+
+    To be registered as a hook on HTTP client:
+
+    .. code-block:: python
+
+        metrics = MetricsRegistry()
+        client = HttpClient(hooks=[metrics])
+        ...
+        metrics.get('priceoverview').network_time.get_percentile(95)
+
+    """
+
+    def __init__(self):
+        self._endpoints = {}
+        self._lock = Lock()
+
+    def fetch_finished(self, event):
+        endpoint = event.endpoint or ENDPOINT_OTHER
+
+        with self._lock:
+            metrics = self._endpoints.get(endpoint)
+
+            if metrics is None:
+                metrics = self._endpoints[endpoint] = EndpointMetrics()
+
+            metrics.add(event)
+
+    def get(self, endpoint):
+        """Returns metrics for the given endpoint.
+
+        :param str endpoint: Endpoint name (see `ENDPOINT_` constants in settings).
+        :rtype: EndpointMetrics
+        """
+        return self._endpoints.get(endpoint) or EndpointMetrics()
+
+    @property
+    def endpoints(self):
+        """Names of endpoints having metrics.
+
+        :rtype: list
+        """
+        return sorted(self._endpoints)
+
+    def as_dict(self):
+        """Returns metrics for all endpoints.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {endpoint: metrics.as_dict() for endpoint, metrics in self._endpoints.items()}
+
+    def reset(self):
+        """Drops all metrics."""
+        with self._lock:
+            self._endpoints.clear()
+
+
+class PhaseTimer(object):
+    """Accumulates time spent in named processing phases (e.g. parsing)
+    summed over all threads.
+
+    Disabled by default, so that measuring costs next to nothing.
+
+    """
+
+    def __init__(self):
+        self.enabled = False
+
+        self._phases = {}
+        self._lock = Lock()
+
+    @contextmanager
+    def measure(self, phase):
+        """Measures time spent within the block if timer is enabled.
+
+        :param str phase:
+        """
+        if not self.enabled:
+            yield
+            return
+
+        started = monotonic()
+
+        try:
+            yield
+
+        finally:
+            self.add(phase, monotonic() - started)
+
+    def add(self, phase, seconds):
+        """Adds time to a phase.
+
+        :param str phase:
+        :param float seconds:
+        """
+        with self._lock:
+            seconds_total, count = self._phases.get(phase, (0, 0))
+            self._phases[phase] = (seconds_total + seconds, count + 1)
+
+    def get(self, phase):
+        """Returns (seconds, count) tuple for a phase.
+
+        :param str phase:
+        :rtype: tuple
+        """
+        return self._phases.get(phase, (0, 0))
+
+    def as_dict(self):
+        """Returns phases data.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return {phase: {'time': seconds, 'count': count} for phase, (seconds, count) in self._phases.items()}
+
+    def reset(self):
+        """Drops all measurements."""
+        with self._lock:
+            self._phases.clear()
+
+
+phases = PhaseTimer()
+"""Phase timer shared by Web API resources."""
@@ -1,8 +1,18 @@
-from collections import OrderedDict
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 from operator import attrgetter
+from threading import Lock
+from time import monotonic
+from weakref import WeakValueDictionary
 
-from ..settings import URL_COMMUNITY_BASE, URL_STORE_API_BASE, APPID_CARDS, APP_CATEGORY_CARDS
-from ..utils import str_sub, DataFetcher
+from ..settings import (
+    URL_COMMUNITY_BASE, URL_STORE_API_BASE, APPID_CARDS, APP_CATEGORY_CARDS,
+    ENDPOINT_APP_DETAILS, ENDPOINT_MARKET_SEARCH)
+from ..metrics import phases, PHASE_PARSE_HTML
+from ..http import submit
+from ..utils import str_sub, DataFetcher, AsyncDataFetcher, ClassTextExtractor
 
 from .market import TAG_ITEM_CLASS_CARD, TAG_CARDBORDER_NORMAL, TAG_CARDBORDER_FOIL
 
@@ -17,6 +27,18 @@ URL_GAMECARDS = (
 
 URL_STORE_APP_DETAILS = URL_STORE_API_BASE + '/appdetails?appids=$appid'
 
+# Maximum number of search results Steam returns per page.
+GAMECARDS_PAGE_SIZE = 100
+
+# Application details parts to request (None to request everything).
+APP_DETAILS_FILTERS = 'basic,categories'
+# Maximum number of applications to request details for at once.
+APP_DETAILS_BATCH_SIZE = 50
+# Seconds to make per-application requests for after the endpoint rejected a batch.
+APP_DETAILS_BATCH_OFF = 60 * 60
+
+LOGGER = logging.getLogger(__name__)
+
 
 def get_filter_cardborder(*cardborder_type):
     """Returns game cards URL filter for a given cardborder
@@ -37,18 +59,210 @@ def get_filter_cardborder(*cardborder_type):
     return '&'.join(filter_)
 
 
+class AppDetailsResolver(object):
+    """Collects applications pending details and fetches the details
+    for as many of them at once as the endpoint allows.
+
+    If the endpoint explicitly rejects a multi-application request, resolver
+    falls back to per-application requests (made concurrently) for a while.
+
+    """
+
+    def __init__(
+            self, batch_size=APP_DETAILS_BATCH_SIZE, filters=APP_DETAILS_FILTERS, workers=4,
+            batch_off=APP_DETAILS_BATCH_OFF):
+        """
+        :param int batch_size: Maximum number of applications per request.
+        :param str filters: Comma-separated details parts to request, e.g. `basic,categories`.
+        :param int workers: Maximum number of per-application requests made concurrently.
+        :param int batch_off: Seconds to make per-application requests for
+            after the endpoint rejected a multi-application request.
+        """
+        self.batch_size = batch_size
+        self.filters = filters
+        self.workers = workers
+        self.batch_off = batch_off
+
+        self._batch_off_till = 0
+        self._pending = OrderedDict()
+        self._lock = Lock()
+
+    @property
+    def batching(self):
+        """Whether multi-application requests are made.
+
+        :rtype: bool
+        """
+        return self.batch_size > 1 and monotonic() >= self._batch_off_till
+
+    def add(self, *apps):
+        """Queues applications for details resolution.
+
+        :param Application apps:
+        """
+        with self._lock:
+            for app in apps:
+                if not app._data_raw:
+                    # Applications are grouped by client, so that each is fetched with its own.
+                    pending = self._pending.setdefault(app.client, OrderedDict())
+                    pending.setdefault(str(app.appid), []).append(app)
+
+    def resolve(self, *apps):
+        """Fetches details for all queued applications
+        (including the given ones) and passes it to application objects.
+
+        :param Application apps:
+        """
+        self.add(*apps)
+
+        with self._lock:
+            pending_all, self._pending = self._pending, OrderedDict()
+
+        for client, pending in pending_all.items():
+            appids = list(pending.keys())
+
+            details = {}
+            batch_size = self.batch_size
+
+            for idx in range(0, len(appids), batch_size):
+                details.update(self._fetch(appids[idx:idx + batch_size], client))
+
+            for appid, apps_ in pending.items():
+                response = {appid: details.get(appid) or {'success': False}}
+
+                for app in apps_:
+                    app._set_data_raw(response)
+
+    def _get_fetcher(self, appids, client, fetcher_cls=DataFetcher):
+        params = None
+
+        if self.filters:
+            params = {'filters': self.filters}
+
+        return fetcher_cls(
+            str_sub(URL_STORE_APP_DETAILS, appid=','.join(appids)),
+            params=params, client=client, endpoint=ENDPOINT_APP_DETAILS)
+
+    def _fetch(self, appids, client):
+        details = {}
+
+        if len(appids) > 1 and self.batching:
+            fetcher = self._get_fetcher(appids, client)
+
+            try:
+                details = fetcher.fetch_json()
+                rejected = details is None  # Endpoint responds with `null` to requests it doesn't allow.
+
+            except ValueError:  # Not a JSON.
+                details = None
+                rejected = False
+
+            if rejected or fetcher.status == 400:
+                LOGGER.debug(
+                    'Application details batch rejected. '
+                    'Making per-application requests for %s seconds ...', self.batch_off)
+                self._batch_off_till = monotonic() + self.batch_off
+
+            # Parsed response may be shared with other callers, so it's copied to be updated.
+            details = dict(details) if isinstance(details, dict) else {}
+
+        # Applications missing from batch response (if any) are requested one by one.
+        appids = [appid for appid in appids if appid not in details]
+
+        def fetch(appid):
+            return self._get_fetcher([appid], client).fetch_json() or {}
+
+        if len(appids) == 1:
+            details.update(fetch(appids[0]))
+
+        elif appids:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                for future in [submit(executor, fetch, appid) for appid in appids]:
+                    details.update(future.result())
+
+        return details
+
+
 class Application(object):
+    """Steam application.
+
+    Objects are interned: `Application(appid)` returns the same object
+    (with the same lazily loaded data) for the same application ID and client
+    as long as the object is referenced somewhere (see `registry`).
+
+    """
+
+    resolver = AppDetailsResolver()
+    """Application details resolver shared by all application objects."""
+
+    registry = WeakValueDictionary()
+    """Application objects indexed by (appid, client).
+    Replace with a dict to keep objects for the process lifetime
+    or with None to switch interning off.
+
+    """
+
+    _registry_lock = Lock()
+
+    def __new__(cls, appid, client=None):
+        registry = cls.registry
+
+        if registry is None:
+            return super().__new__(cls)
+
+        key = (str(appid), client)
+
+        with cls._registry_lock:
+            app = registry.get(key)
+
+            if app is None:
+                app = registry[key] = super().__new__(cls)
+
+        return app
+
+    def __init__(self, appid, client=None):
+        """
+        :param str appid: Application ID.
+        :param HttpClient client: HTTP client to use. Default shared client is used if not set.
+        """
+        if 'appid' in self.__dict__:
+            return  # Interned object is already initialized.
 
-    def __init__(self, appid):
         self.appid = appid
+        self.client = client
         self._data_raw = {}
 
+    def invalidate(self):
+        """Drops application data, so that it is fetched anew on next access."""
+        self._data_raw = {}
+
+    @classmethod
+    def invalidate_all(cls):
+        """Drops data of all interned application objects."""
+        for app in list((cls.registry or {}).values()):
+            app.invalidate()
+
+    @classmethod
+    def prefetch(cls, apps):
+        """Fetches details for many applications at once.
+
+        :param Iterable[Application] apps:
+        """
+        cls.resolver.resolve(*apps)
+
     def _get_data_raw(self):
-        url = str_sub(URL_STORE_APP_DETAILS, appid=self.appid)
-        response = DataFetcher(url).fetch_json()
-        data = response[self.appid]
+        # Details for other queued applications are fetched along.
+        self.resolver.resolve(self)
+        return self._data_raw
+
+    async def _get_data_raw_async(self):
+        response = await self.resolver._get_fetcher([str(self.appid)], self.client, AsyncDataFetcher).fetch_json()
+        return self._set_data_raw(response or {})
 
-        if not data['success']:
+    def _set_data_raw(self, response):
+        data = response.get(str(self.appid)) or {}
+
+        if not data.get('success'):
             return {}
 
         data = data['data']
@@ -68,29 +282,113 @@ class Application(object):
         not self._data_raw and self._get_data_raw()
         return self._data_raw.get('name', '<unresolved %s>' % self.appid)
 
-    def get_cards(self, normal=True, foil=False):
-        from .market import Card
-
-        url = str_sub(
+    def _get_cards_url(self, normal, foil):
+        return str_sub(
             URL_GAMECARDS,
             appid=self.appid,
             cardboarder=get_filter_cardborder(
                 normal and TAG_CARDBORDER_NORMAL,
                 foil and TAG_CARDBORDER_FOIL))
 
-        data = DataFetcher(url).fetch_json()
-        soup = DataFetcher.get_soup(data['results_html'])
+    @classmethod
+    def _get_card_names(cls, html):
+        with phases.measure(PHASE_PARSE_HTML):
+            return cls._parse_card_names(html)
+
+    @classmethod
+    def _parse_card_names(cls, html):
+        cls_row = 'market_listing_row_link'
+        cls_item = 'market_listing_item_name'
+
+        try:
+            names = ClassTextExtractor.extract(html, cls_row, cls_item)
 
-        rows = soup.select('.market_listing_row_link')
-        cards = []
+        except Exception:  # Malformed markup. Leave it to the robust parser.
+            names = []
 
-        for row in rows:
-            name = row.select('.market_listing_item_name')[0].text
-            cards.append(Card(self, name))
+        if names or cls_row not in html:
+            return names
 
-        cards = OrderedDict(
+        soup = DataFetcher.get_soup(html)
+        return [row.select('.' + cls_item)[0].text for row in soup.select('.' + cls_row)]
+
+    def _get_cards_page_fetcher(self, url, start, count, fetcher_cls=DataFetcher):
+        return fetcher_cls(
+            url, params={'start': start, 'count': count}, client=self.client, endpoint=ENDPOINT_MARKET_SEARCH)
+
+    def _get_cards_from_data(self, data):
+        from .market import Card
+        return [Card(self, name) for name in self._get_card_names(data['results_html'])]
+
+    @classmethod
+    def _get_cards_sorted(cls, cards):
+        return OrderedDict(
             [(card.market_hash, card) for card in sorted(cards, key=attrgetter('title'))])
 
+    def iter_cards(self, normal=True, foil=False, page_size=GAMECARDS_PAGE_SIZE, prefetch=2):
+        """Generates market Card objects page by page as pages arrive.
+
+        When the first page tells the total number of cards,
+        up to `prefetch` next pages are fetched concurrently.
+
+        :param bool normal: Include normal cards.
+        :param bool foil: Include foil cards.
+        :param int page_size: Number of cards requested per page.
+        :param int prefetch: Maximum number of pages fetched concurrently.
+        :rtype: Iterable[Card]
+        """
+        url = self._get_cards_url(normal, foil)
+
+        data = self._get_cards_page_fetcher(url, 0, page_size).fetch_json()
+        yield from self._get_cards_from_data(data)
+
+        starts = iter(range(page_size, data.get('total_count') or 0, page_size))
+
+        with ThreadPoolExecutor(max_workers=prefetch) as executor:
+            pending = deque()
+
+            def submit_next():
+                start = next(starts, None)
+
+                if start is not None:
+                    pending.append(submit(executor, self._get_cards_page_fetcher(url, start, page_size).fetch_json))
+
+            for _ in range(prefetch):
+                submit_next()
+
+            while pending:
+                data = pending.popleft().result()
+                submit_next()  # Keep the number of pages in memory bounded.
+                yield from self._get_cards_from_data(data)
+
+    def get_cards(self, normal=True, foil=False):
+        from .market import Card
+
+        cards = self._get_cards_sorted(self.iter_cards(normal, foil))
+
         booster = Card.get_booster(self) if cards else None
 
         return cards, booster
+
+    async def get_cards_async(self, normal=True, foil=False, page_size=GAMECARDS_PAGE_SIZE):
+        """Asynchronous counterpart of `get_cards()`."""
+        from .market import Card
+
+        url = self._get_cards_url(normal, foil)
+
+        data = await self._get_cards_page_fetcher(url, 0, page_size, AsyncDataFetcher).fetch_json()
+        pages = [data]
+
+        pages.extend(await asyncio.gather(*[
+            self._get_cards_page_fetcher(url, start, page_size, AsyncDataFetcher).fetch_json()
+            for start in range(page_size, data.get('total_count') or 0, page_size)]))
+
+        cards = self._get_cards_sorted(card for data in pages for card in self._get_cards_from_data(data))
+
+        booster = None
+
+        if cards:
+            not self._data_raw and await self._get_data_raw_async()
+            booster = Card.get_booster(self)
+
+        return cards, booster
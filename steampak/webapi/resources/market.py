@@ -1,10 +1,20 @@
+import logging
 import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
+from functools import lru_cache
+from threading import Lock
+from time import monotonic, time
 
-from ..settings import CURRENCY_RUB, URL_COMMUNITY_BASE, APPID_CARDS, CURRENCIES
-from ..utils import DataFetcher
+from ..settings import (
+    CURRENCY_RUB, URL_COMMUNITY_BASE, APPID_CARDS, CURRENCIES, CURRENCIES_BY_CODE, ENDPOINT_PRICE_OVERVIEW)
+from ..metrics import phases, PHASE_NORMALIZE_PRICES
+from ..http import submit, get_client
+from ..utils import DataFetcher, AsyncDataFetcher
 
-RE_CURRENCY = re.compile(r'[^\d]*(\d+([.,]\d+)?)[^\d]*', re.U)
+# Number with possible thousands separators (comma, dot, apostrophe, spaces) and decimal part.
+RE_MONEY = re.compile(r"\d[\d.,'\s]*", re.U)
 
 URL_PRICE_OVERVIEW = URL_COMMUNITY_BASE + '/market/priceoverview/'
 
@@ -19,68 +29,349 @@ TAG_ITEM_CLASS_EMOTICON = 'item_class_4'
 TAG_ITEM_CLASS_BOOSTER = 'item_class_5'
 TAG_ITEM_CLASS_GEM = 'item_class_7'
 
+LOGGER = logging.getLogger(__name__)
+
+# Price refreshes in progress indexed by (market_hash, currency).
+_PRICE_REFRESHES = {}
+_PRICE_REFRESHES_LOCK = Lock()
+
+
+@lru_cache(maxsize=4096)
+def parse_money(value):
+    """Parses money string as formatted by Steam for various locales into Decimal.
+
+    Handles currency symbols, thousands separators and zero cents dashes, e.g.:
+    `$1,234.56`, `1.234,56€`, `1 234,56 pуб.`, `CHF 1'234.56`, `12,--€`.
+
+    Results are memoized, since the same prices are seen over and over.
+
+    :param str value:
+    :rtype: Decimal
+    """
+    match = RE_MONEY.search(value.replace('--', '00'))
+
+    if not match:
+        return Decimal(0)
+
+    number = ''.join(match.group(0).split()).replace("'", '').rstrip('.,')
+
+    integer = number
+    fraction = ''
+
+    pos = max(number.rfind('.'), number.rfind(','))
+
+    if pos != -1:
+        fraction = number[pos + 1:]
+
+        # Prices have no more than two decimals, so a three digit group
+        # is considered a thousands group unless both separators are used.
+        if len(fraction) != 3 or ('.' in number and ',' in number):
+            integer = number[:pos]
+
+        else:
+            fraction = ''
+
+    integer = integer.replace('.', '').replace(',', '')
+
+    return Decimal('%s.%s' % (integer, fraction) if fraction else integer)
+
+
+def normalize_price_data(payloads, currency):
+    """Converts raw `priceoverview` responses into price data
+    with Decimal prices and volume.
+
+    :param Iterable[dict] payloads: Raw responses.
+    :param int currency: Currency ID.
+    :rtype: list[dict]
+    """
+    with phases.measure(PHASE_NORMALIZE_PRICES):
+        return _normalize_price_data(payloads, currency)
+
+
+def _normalize_price_data(payloads, currency):
+    currency_code = CURRENCIES[currency]
+    parse = parse_money
+
+    normalized = []
+    append = normalized.append
+
+    for payload in payloads:
+
+        if not payload or not payload.get('success'):
+            append({})
+            continue
+
+        price_data = dict(payload)
+        price_data['lowest_price'] = parse(payload.get('lowest_price', '0'))
+        price_data['median_price'] = parse(payload.get('median_price', '0'))
+        price_data['volume'] = parse(payload.get('volume', '0'))
+        price_data['currency'] = currency_code
+
+        append(price_data)
+
+    return normalized
+
 
 class Item(object):
 
-    def __init__(self, app, title):
+    price_history = None
+    """PriceHistory object. If set, every fetched price is appended to it."""
+
+    price_max_age = None
+    """Maximum age (seconds) of price data returned by `price_*` properties.
+    Stale price data is still returned, but is refreshed in background.
+    If not set, price data is fetched once and never refreshed.
+
+    """
+
+    def __init__(self, app, title, client=None):
+        """
+        :param Application|str app: Application object or ID.
+        :param str title: Item title.
+        :param HttpClient client: HTTP client to use. If not set, application client is used.
+        """
         from .apps import Application
 
         self.title = title
         self.app = app
 
         if not isinstance(app, Application):
-            self.app = Application(app)
+            self.app = Application(app, client=client)
+
+        self.client = client or self.app.client
 
         self._price_data = {}
+        self._price_currency = CURRENCY_RUB
+        self._price_fetched = 0
+        self._price_refresh = None
 
-    def get_price_data(self, currency=CURRENCY_RUB):
-        url = URL_PRICE_OVERVIEW
+    @classmethod
+    def _get_currency_id(cls, currency):
 
         if not isinstance(currency, int):
             # Consider ISO currency code.
-            currency = {cur_code: cur_id for cur_id, cur_code in CURRENCIES.items()}.get(currency)
+            currency = CURRENCIES_BY_CODE.get(currency)
 
-        json = DataFetcher(url, params={
+        return currency
+
+    def _get_price_fetcher(self, currency, fetcher_cls=DataFetcher):
+        return fetcher_cls(URL_PRICE_OVERVIEW, params={
             'appid': APPID_CARDS,
             'currency': currency,
             'market_hash_name': self.market_hash
-        }).fetch_json()
+        }, client=self.client, endpoint=ENDPOINT_PRICE_OVERVIEW)
 
-        def format_money(val):
-            match = RE_CURRENCY.search(val)
-            if match:
-                val = match.group(1)
+    def _use_price_data(self, price_data, currency, fetched=None):
+        self._price_data = price_data
+        self._price_currency = currency
+        self._price_fetched = fetched or monotonic()
 
-            val = val.replace(',', '.')
-            return Decimal(val)
+    def _set_price_data(self, json, currency):
+        price_data, = normalize_price_data([json], currency)
+        self._use_price_data(price_data, currency)
 
-        price_data = {}
-        if json['success']:
+        history = self.price_history
 
-            price_data = json
-            price_data['lowest_price'] = format_money(price_data.get('lowest_price', '0'))
-            price_data['median_price'] = format_money(price_data.get('median_price', '0'))
-            price_data['volume'] = format_money(price_data.get('volume', '0'))
-            price_data['currency'] = CURRENCIES[currency]
+        if history is not None and price_data:
+            history.append(self.market_hash, price_data)
 
-        self._price_data = price_data
+        return price_data
+
+    def get_price_last(self, currency=CURRENCY_RUB, max_age=None):
+        """Returns last known price data from price history (see `price_history`)
+        without going to network. Returns empty dict if price is not known
+        or older than `max_age`.
+
+        :param str|int currency: Currency ID or ISO code.
+        :param float max_age: Maximum price age in seconds.
+        :rtype: dict
+        """
+        history = self.price_history
+
+        if history is None:
+            return {}
+
+        currency = self._get_currency_id(currency)
+        currency_code = CURRENCIES[currency]
+        point = history.get_last(self.market_hash, currency_code, max_age=max_age)
+
+        if point is None:
+            return {}
+
+        price_data = dict(point._asdict(), success=True, currency=currency_code)
+        self._use_price_data(price_data, currency, fetched=monotonic() - (time() - point.timestamp))
 
         return price_data
 
+    def get_price_data(self, currency=CURRENCY_RUB, max_age=None):
+        """Fetches price data for the item.
+
+        :param str|int currency: Currency ID or ISO code.
+        :param float max_age: If set, price from price history no older
+            than the given number of seconds is returned without a network request.
+        :rtype: dict
+        """
+        if max_age:
+            price_data = self.get_price_last(currency, max_age=max_age)
+
+            if price_data:
+                return price_data
+
+        currency = self._get_currency_id(currency)
+        json = self._get_price_fetcher(currency).fetch_json()
+        return self._set_price_data(json, currency)
+
+    async def get_price_data_async(self, currency=CURRENCY_RUB, max_age=None):
+        """Asynchronous counterpart of `get_price_data()`."""
+        if max_age:
+            price_data = self.get_price_last(currency, max_age=max_age)
+
+            if price_data:
+                return price_data
+
+        currency = self._get_currency_id(currency)
+        json = await self._get_price_fetcher(currency, AsyncDataFetcher).fetch_json()
+        return self._set_price_data(json, currency)
+
+    @classmethod
+    def iter_prices(cls, items, currency=CURRENCY_RUB, workers=4):
+        """Fetches prices for many market items concurrently.
+
+        Items sharing the same market hash are priced with a single request.
+        Generates items (with price data set) in the order they were given
+        as soon as their prices are available.
+
+        :param Iterable[Item] items:
+        :param str|int currency: Currency ID or ISO code.
+        :param int workers: Maximum number of prices fetched concurrently
+            (requests are rate limited by HTTP client anyway).
+        :rtype: Iterable[Item]
+        """
+        currency = cls._get_currency_id(currency)
+        items = list(items)
+
+        def fetch(item_):
+            return item_.get_price_data(currency)
+
+        executor = ThreadPoolExecutor(max_workers=workers)
+        items_pending = iter(items)
+        fetching = {}
+        prices = {}
+        seen = set()
+
+        def submit_next():
+            for item_ in items_pending:
+                market_hash_ = item_.market_hash
+
+                if market_hash_ not in seen:
+                    seen.add(market_hash_)
+                    fetching[market_hash_] = submit(executor, fetch, item_)
+                    return
+
+        try:
+            for _ in range(workers):
+                submit_next()
+
+            for item in items:
+                market_hash = item.market_hash
+                future = fetching.pop(market_hash, None)
+
+                if future is not None:
+                    prices[market_hash] = future.result()
+                    submit_next()  # Keep the number of fetches in flight bounded.
+
+                item._use_price_data(prices[market_hash], currency)
+                yield item
+
+        finally:
+            # Do not fetch prices nobody waits for (on error or when consumer stops early).
+            for future in fetching.values():
+                future.cancel()
+
+            executor.shutdown(wait=False)
+
+    @classmethod
+    def get_prices(cls, items, currency=CURRENCY_RUB, workers=4):
+        """Fetches prices for many market items concurrently.
+        Returns price data indexed by market hash.
+
+        See `iter_prices()`.
+
+        :param Iterable[Item] items:
+        :param str|int currency: Currency ID or ISO code.
+        :param int workers: Maximum number of prices fetched concurrently.
+        :rtype: OrderedDict
+        """
+        return OrderedDict(
+            (item.market_hash, item._price_data)
+            for item in cls.iter_prices(items, currency=currency, workers=workers))
+
+    @property
+    def price_stale(self):
+        """Whether price data is older than `price_max_age`.
+
+        :rtype: bool
+        """
+        max_age = self.price_max_age
+        return bool(max_age and monotonic() - self._price_fetched > max_age)
+
+    def refresh_price_data(self):
+        """Fetches price data anew in background.
+
+        Concurrent refreshes of the same market hash and currency
+        (even for different item objects) are served by one request.
+
+        :rtype: concurrent.futures.Future
+        """
+        future = self._price_refresh
+
+        if future is not None and not future.done():
+            return future
+
+        currency = self._price_currency
+        key = (self.market_hash, currency)
+
+        with _PRICE_REFRESHES_LOCK:
+            future = _PRICE_REFRESHES.get(key)
+
+            if future is None:
+                executor = (self.client or get_client()).executor
+                future = _PRICE_REFRESHES[key] = executor.submit(self._get_price_fetcher(currency).fetch_json)
+                future.add_done_callback(lambda _: _PRICE_REFRESHES.pop(key, None))
+
+        def use_refreshed(future_):
+            try:
+                self._set_price_data(future_.result(), currency)
+
+            except Exception as e:
+                LOGGER.warning('Unable to refresh price for %s: %s', self.market_hash, e)
+
+        future.add_done_callback(use_refreshed)
+        self._price_refresh = future
+
+        return future
+
+    def _get_price_data_cached(self):
+        # Price data is empty for unsuccessful lookups too, so fetch time tells whether it's fetched.
+        if not self._price_fetched:
+            self.get_price_data(self._price_currency)
+
+        elif self.price_stale:
+            self.refresh_price_data()
+
+        return self._price_data
+
     @property
     def price_lowest(self):
-        not self._price_data and self.get_price_data()
-        return self._price_data.get('lowest_price', 0)
+        return self._get_price_data_cached().get('lowest_price', 0)
 
     @property
     def price_median(self):
-        not self._price_data and self.get_price_data()
-        return self._price_data.get('median_price', 0)
+        return self._get_price_data_cached().get('median_price', 0)
 
     @property
     def price_currency(self):
-        not self._price_data and self.get_price_data()
-        return self._price_data.get('currency')
+        return self._get_price_data_cached().get('currency')
 
     @property
     def market_hash(self):
@@ -103,4 +394,4 @@ class Card(Item):
 
         booster_title = '%s Booster Pack' % app.title
 
-        return Card(app, booster_title)
+        return Card(app, booster_title, client=app.client)
@@ -1,5 +1,10 @@
-from ..settings import URL_COMMUNITY_BASE, APPID_STEAM
-from ..utils import str_sub, DataFetcher
+import gzip
+import json
+from collections import OrderedDict, defaultdict, namedtuple
+
+from ..settings import (
+    URL_COMMUNITY_BASE, APPID_STEAM, ENDPOINT_INVENTORY, ENDPOINT_GAMES_OWNED, ENDPOINT_PROFILE)
+from ..utils import str_sub, DataFetcher, AsyncDataFetcher
 from ..exceptions import ResponseError
 from .market import Item, Card, TAG_ITEM_CLASS_CARD
 
@@ -9,20 +14,308 @@ URL_USER_INVENTORY_PUBLIC_BASE = URL_USER_BASE + '/inventory/json/'
 URL_USER_INVENTORY_PUBLIC_APP = URL_USER_INVENTORY_PUBLIC_BASE + '$appid/6'
 URL_USER_INVENTORY_PUBLIC_STEAM = str_sub(URL_USER_INVENTORY_PUBLIC_APP, appid=APPID_STEAM)
 URL_USER_GAMES_OWNED = URL_USER_BASE + '/games/?xml=1'
+URL_USER_PROFILE = URL_USER_BASE + '/?xml=1'
+URL_INVENTORY_STEAM = URL_COMMUNITY_BASE + '/inventory/$steamid/' + APPID_STEAM + '/6'
 
 INV_CLASSID_GEM = '667924416'
 
+# Number of inventory items requested per page.
+INVENTORY_PAGE_SIZE = 2000
+
+
+class InventoryClass(object):
+    """Inventory item class (items with the same description) with the total amount owned."""
+
+    __slots__ = ['classid', 'instanceid', 'name', 'appid', 'tags', 'item_class', 'amount']
+
+    def __init__(self, classid, instanceid):
+        self.classid = classid
+        self.instanceid = instanceid
+        self.name = None
+        self.appid = None
+        self.tags = frozenset()
+        self.item_class = None
+        self.amount = 0
+
+    def __repr__(self):
+        return '<InventoryClass %s_%s %s x%s>' % (self.classid, self.instanceid, self.name, self.amount)
+
+
+class InventoryIndex(object):
+    """Inventory index built once from inventory pages.
+
+    Allows inventory lookups by class ID, `internal_name` tag,
+    application (`market_fee_app`) and item class
+    without walking the whole inventory.
+
+    """
+
+    def __init__(self):
+        self.classes = OrderedDict()
+        """Inventory classes indexed by (classid, instanceid)."""
+
+        self.by_classid = defaultdict(list)
+        self.by_tag = defaultdict(list)
+        self.by_appid = defaultdict(list)
+        self.by_item_class = defaultdict(list)
+
+    @classmethod
+    def from_pages(cls, pages):
+        """Builds index from (assets, descriptions) pages.
+
+        :param Iterable[tuple] pages: See `User.iter_inventory_pages()`.
+        :rtype: InventoryIndex
+        """
+        index = cls()
+
+        for assets, descriptions in pages:
+            index.add_page(assets, descriptions)
+
+        return index
+
+    def _get_class(self, classid, instanceid):
+        key = (classid, instanceid or '0')
+        cls = self.classes.get(key)
+
+        if cls is None:
+            cls = self.classes[key] = InventoryClass(*key)
+            self.by_classid[classid].append(cls)
+
+        return cls
+
+    def add_page(self, assets, descriptions):
+        """Adds a page of inventory items to the index.
+
+        :param list assets:
+        :param list descriptions:
+        """
+        for description in descriptions:
+            cls = self._get_class(description['classid'], description.get('instanceid'))
+
+            if cls.name is not None:
+                continue  # Description is repeated on pages.
+
+            cls.name = description['name']
+            cls.appid = str(description['market_fee_app'])
+            cls.tags = frozenset(tag['internal_name'] for tag in description.get('tags', []))
+
+            self.by_appid[cls.appid].append(cls)
+
+            for tag in cls.tags:
+                self.by_tag[tag].append(cls)
+
+                if tag.startswith('item_class_'):
+                    cls.item_class = tag
+                    self.by_item_class[tag].append(cls)
+
+        for asset in assets:
+            self._get_class(asset['classid'], asset.get('instanceid')).amount += int(asset['amount'])
+
+    def filter(self, tag=None, appid=None, item_class=None):
+        """Returns inventory classes matching all the given criteria.
+
+        Lookup starts from the smallest index bucket matching a criterion.
+
+        :param str tag: `internal_name` tag value, e.g. `TAG_CARDBORDER_FOIL`.
+        :param str appid: Application ID.
+        :param str item_class: Item class tag, e.g. `TAG_ITEM_CLASS_CARD`.
+        :rtype: list[InventoryClass]
+        """
+        buckets = []
+
+        if tag is not None:
+            buckets.append(self.by_tag.get(tag, []))
+
+        if appid is not None:
+            appid = str(appid)
+            buckets.append(self.by_appid.get(appid, []))
+
+        if item_class is not None:
+            buckets.append(self.by_item_class.get(item_class, []))
+
+        if not buckets:
+            return [cls for cls in self.classes.values() if cls.name is not None]
+
+        return [
+            cls for cls in min(buckets, key=len)
+            if (tag is None or tag in cls.tags) and
+            (appid is None or cls.appid == appid) and
+            (item_class is None or cls.item_class == item_class)]
+
+    def get_amount(self, classid):
+        """Returns total amount of items of the given class.
+
+        :param str classid:
+        :rtype: int
+        """
+        return sum(cls.amount for cls in self.by_classid.get(classid, []))
+
+
+InventoryChanges = namedtuple('InventoryChanges', ['added', 'removed', 'changed'])
+"""Inventory changes between two snapshots.
+
+* added - {assetid: (classid, instanceid, amount)}
+* removed - {assetid: (classid, instanceid, amount)}
+* changed - {assetid: (classid, instanceid, amount_before, amount_after)}
+
+"""
+
+
+class InventorySnapshot(object):
+    """Compact inventory state: assets indexed by asset ID.
+    Used to get inventory changes between polls.
+
+    """
+
+    format_version = 1
+
+    def __init__(self, assets=None):
+        """
+        :param dict assets: {assetid: (classid, instanceid, amount)}
+        """
+        self.assets = assets or {}
+
+    def __len__(self):
+        return len(self.assets)
+
+    def add_assets(self, assets):
+        """Adds assets from inventory page.
+
+        :param list assets:
+        """
+        snapshot = self.assets
+
+        for asset in assets:
+            snapshot[asset['assetid']] = (asset['classid'], asset.get('instanceid') or '0', int(asset['amount']))
+
+    def diff(self, snapshot):
+        """Returns changes from this snapshot to the given (newer) one.
+
+        :param InventorySnapshot snapshot:
+        :rtype: InventoryChanges
+        """
+        before, after = self.assets, snapshot.assets
+
+        added = {assetid: asset for assetid, asset in after.items() if assetid not in before}
+        removed = {assetid: asset for assetid, asset in before.items() if assetid not in after}
+        changed = {}
+
+        for assetid, asset in after.items():
+            asset_before = before.get(assetid)
+
+            if asset_before is not None and asset_before[2] != asset[2]:
+                changed[assetid] = asset[:2] + (asset_before[2], asset[2])
+
+        return InventoryChanges(added, removed, changed)
+
+    def save(self, filepath):
+        """Saves snapshot into a (gzipped JSON) file.
+
+        :param str filepath:
+        """
+        with gzip.open(filepath, 'wt', encoding='utf-8') as f:
+            json.dump({
+                'version': self.format_version,
+                'assets': [[assetid] + list(asset) for assetid, asset in self.assets.items()],
+            }, f, separators=(',', ':'))
+
+    @classmethod
+    def load(cls, filepath):
+        """Loads snapshot from a file.
+
+        :param str filepath:
+        :rtype: InventorySnapshot
+        """
+        with gzip.open(filepath, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+
+        if data.get('version') != cls.format_version:
+            raise ValueError('Unsupported inventory snapshot format version: %s' % data.get('version'))
+
+        return cls({assetid: (classid, instanceid, amount) for assetid, classid, instanceid, amount in data['assets']})
+
 
 class User(object):
 
-    def __init__(self, username):
+    def __init__(self, username, client=None, steamid=None):
+        """
+        :param str username: Steam user name (as in profile URL).
+        :param HttpClient client: HTTP client to use. Default shared client is used if not set.
+        :param str steamid: Steam ID (64 bit). Fetched from user profile if not set.
+        """
         self.username = username
+        self.client = client
+        self._steamid = steamid
         self._intentory_raw = None
+        self._inventory = None
+
+        self.inventory_snapshot = None
+        """Inventory snapshot taken on last `poll_inventory_changes()`."""
+
+    @property
+    def steamid(self):
+        """Steam ID (64 bit) of the user.
+
+        :rtype: str
+        """
+        if not self._steamid:
+            url = str_sub(URL_USER_PROFILE, username=self.username)
+            xml = DataFetcher(url, client=self.client, endpoint=ENDPOINT_PROFILE).fetch_xml()
+            steamid = xml.findtext('steamID64')
+
+            if not steamid:
+                raise ResponseError(xml.findtext('error') or 'No Steam ID in profile', url)
+
+            self._steamid = steamid
+
+        return self._steamid
+
+    def iter_inventory_pages(self, page_size=INVENTORY_PAGE_SIZE):
+        """Generates inventory page by page, so that the whole inventory
+        need not to be held in memory.
+
+        Each page is an (assets, descriptions) tuple of lists
+        with items as returned by Steam.
+
+        :param int page_size: Number of items requested per page.
+        :rtype: Iterable[tuple]
+        """
+        url = str_sub(URL_INVENTORY_STEAM, steamid=self.steamid)
+        start_assetid = None
+
+        while True:
+            params = {'l': 'english', 'count': page_size}
+
+            if start_assetid:
+                params['start_assetid'] = start_assetid
+
+            response = DataFetcher(url, params=params, client=self.client, endpoint=ENDPOINT_INVENTORY).fetch_json()
+
+            if not response:
+                raise ResponseError('No response', url)
+
+            if not response.get('success'):
+                raise ResponseError(response.get('Error') or response.get('error') or 'Unsuccessful', url)
+
+            yield response.get('assets', []), response.get('descriptions', [])
+
+            start_assetid = response.get('last_assetid')
+
+            if not response.get('more_items') or not start_assetid:
+                break
 
     def _get_inventory_raw(self):
         url = str_sub(URL_USER_INVENTORY_PUBLIC_STEAM, username=self.username)
+        response = DataFetcher(url, client=self.client, endpoint=ENDPOINT_INVENTORY).fetch_json()
+        return self._set_inventory_raw(response, url)
+
+    async def _get_inventory_raw_async(self):
+        url = str_sub(URL_USER_INVENTORY_PUBLIC_STEAM, username=self.username)
+        response = await AsyncDataFetcher(url, client=self.client, endpoint=ENDPOINT_INVENTORY).fetch_json()
+        return self._set_inventory_raw(response, url)
+
+    def _set_inventory_raw(self, response, url):
 
-        response = DataFetcher(url).fetch_json()
         if not response:
             raise ResponseError('No response', url)
 
@@ -33,39 +326,89 @@ class User(object):
 
         return response
 
-    def traverse_inventory(self, item_filter=None):
-        """Generates market Item objects for each inventory item.
+    @property
+    def inventory(self):
+        """Inventory index. Inventory is fetched once (page by page)
+        on first access. Use `invalidate_inventory()` to fetch anew.
 
-        :param str item_filter: See `TAG_ITEM_CLASS_` contants from .market module.
+        :rtype: InventoryIndex
+        """
+        if self._inventory is None:
+            self._inventory = InventoryIndex.from_pages(self.iter_inventory_pages())
+
+        return self._inventory
+
+    def invalidate_inventory(self):
+        """Drops inventory index, so that inventory is fetched anew on next access."""
+        self._inventory = None
+
+    def poll_inventory_changes(self, snapshot=None):
+        """Fetches inventory and returns changes since previous poll
+        (or since the given snapshot, e.g. one loaded from a file).
+
+        Inventory index (see `inventory`) is updated along,
+        so that descriptions of changed assets may be looked up there.
 
+        :param InventorySnapshot snapshot: Snapshot to compare to.
+            If not set, snapshot from previous poll is used.
+        :rtype: InventoryChanges
         """
-        not self._intentory_raw and self._get_inventory_raw()
+        snapshot_before = snapshot
 
-        for item in self._intentory_raw['rgDescriptions'].values():
-            tags = item['tags']
-            for tag in tags:
-                internal_name = tag['internal_name']
-                if item_filter is None or internal_name == item_filter:
+        if snapshot_before is None:
+            snapshot_before = self.inventory_snapshot or InventorySnapshot()
+        snapshot_after = InventorySnapshot()
+        index = InventoryIndex()
 
-                    item_type = Item
-                    if internal_name == TAG_ITEM_CLASS_CARD:
-                        item_type = Card
+        for assets, descriptions in self.iter_inventory_pages():
+            index.add_page(assets, descriptions)
+            snapshot_after.add_assets(assets)
 
-                    appid = item['market_fee_app']
-                    title = item['name']
+        self._inventory = index
+        self.inventory_snapshot = snapshot_after
 
-                    yield item_type(appid, title)
+        return snapshot_before.diff(snapshot_after)
+
+    def traverse_inventory(self, item_filter=None):
+        """Generates market Item objects for each inventory item.
+
+        :param str item_filter: See `TAG_ITEM_CLASS_` contants from .market module.
+
+        """
+        for cls in self.inventory.filter(tag=item_filter):
+            item_type = Card if TAG_ITEM_CLASS_CARD in cls.tags else Item
+            yield item_type(cls.appid, cls.name, client=self.client)
 
     @property
     def gems_total(self):
-        not self._intentory_raw and self._get_inventory_raw()
+        """Total number of gems in inventory.
 
-        items = self._intentory_raw['rgInventory']
-        return sum([int(item['amount']) for item in items.values() if item['classid'] == INV_CLASSID_GEM])
+        :rtype: int
+        """
+        return self.inventory.get_amount(INV_CLASSID_GEM)
+
+    def iter_games_owned(self):
+        """Generates (appid, title) tuples for games owned by the user
+        as the games list is being downloaded.
+
+        :rtype: Iterable[tuple]
+        """
+        url = str_sub(URL_USER_GAMES_OWNED, username=self.username)
+
+        for game in DataFetcher(url, client=self.client, endpoint=ENDPOINT_GAMES_OWNED).iter_xml('game'):
+            yield game.findtext('appID'), game.findtext('name')
 
     def get_games_owned(self):
+        return {appid: {'appid': appid, 'title': title} for appid, title in self.iter_games_owned()}
+
+    async def get_games_owned_async(self):
+        """Asynchronous counterpart of `get_games_owned()`."""
         url = str_sub(URL_USER_GAMES_OWNED, username=self.username)
-        xml = DataFetcher(url).fetch_xml()
+        xml = await AsyncDataFetcher(url, client=self.client, endpoint=ENDPOINT_GAMES_OWNED).fetch_xml()
+        return self._get_games_from_xml(xml)
+
+    @classmethod
+    def _get_games_from_xml(cls, xml):
 
         games = {}
         for el in xml:
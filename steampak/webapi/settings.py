@@ -7,6 +7,50 @@ APP_CATEGORY_CARDS = 29
 URL_COMMUNITY_BASE = 'http://steamcommunity.com'
 URL_STORE_API_BASE = 'http://store.steampowered.com/api'
 
+# Endpoint names used to tell one kind of request from another.
+ENDPOINT_APP_DETAILS = 'appdetails'
+ENDPOINT_MARKET_SEARCH = 'market_search'
+ENDPOINT_PRICE_OVERVIEW = 'priceoverview'
+ENDPOINT_INVENTORY = 'inventory'
+ENDPOINT_GAMES_OWNED = 'games_owned'
+ENDPOINT_PROFILE = 'profile'
+
+# Response cache time-to-live (in seconds) per endpoint.
+# Responses from endpoints not listed here are not cached.
+CACHE_TTLS = {
+    ENDPOINT_APP_DETAILS: 7 * 24 * 60 * 60,
+    ENDPOINT_MARKET_SEARCH: 24 * 60 * 60,
+    ENDPOINT_GAMES_OWNED: 60 * 60,
+    ENDPOINT_PROFILE: 7 * 24 * 60 * 60,
+    ENDPOINT_PRICE_OVERVIEW: 5 * 60,
+}
+
+# Maximum response cache size in bytes.
+CACHE_SIZE_MAX = 50 * 1024 * 1024
+
+# Maximum number of parsed cached responses (JSON, XML) kept in memory
+# to be reused when contents are revalidated (not modified).
+CACHE_PARSED_MAX = 64
+
+# Token bucket parameters per host: (requests per second, burst size).
+# Hosts not listed here are not rate limited.
+RATE_LIMITS = {
+    'steamcommunity.com': (0.5, 10),
+}
+
+# Maximum retries for a request hitting `429 Too Many Requests`.
+RETRIES_MAX = 5
+# Exponential backoff parameters (in seconds) used when no `Retry-After` is given.
+RETRY_BACKOFF_BASE = 5
+RETRY_BACKOFF_MAX = 120
+
+# Endpoints which requests are hedged by default (see `HedgePolicy`).
+HEDGE_ENDPOINTS = {ENDPOINT_PRICE_OVERVIEW, ENDPOINT_MARKET_SEARCH}
+
+# Seconds to wait for a connection to be established and for server to send data.
+TIMEOUT_CONNECT = 10
+TIMEOUT_READ = 30
+
 CURRENCY_USD = 1
 CURRENCY_GBP = 2
 CURRENCY_EUR = 3
@@ -20,3 +64,5 @@ CURRENCIES = {
     CURRENCY_CHF: 'CHF',
     CURRENCY_RUB: 'RUB',
 }
+
+CURRENCIES_BY_CODE = {cur_code: cur_id for cur_id, cur_code in CURRENCIES.items()}
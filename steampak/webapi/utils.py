@@ -1,57 +1,582 @@
+import asyncio
 import logging
-from time import sleep
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+from contextvars import copy_context
+from html.parser import HTMLParser
+from time import sleep, monotonic
+from urllib.parse import urlsplit
 from xml.etree import ElementTree
 from string import Template
 
 import requests
+from urllib3.exceptions import ReadTimeoutError
 from bs4 import BeautifulSoup
 
+try:
+    from orjson import loads as json_loads
+
+except ImportError:  # pragma: nocover
+    try:
+        from ujson import loads as json_loads
+
+    except ImportError:
+        from json import loads as json_loads
+
+from .cache import CacheEntry, ResponseCache, MemoryCache, FileCache  # noqa
+from .exceptions import TooManyRequests, RequestTimeout, DeadlineExceeded
+from .http import (  # noqa
+    HEADERS_DEFAULT, HttpClient, RateLimiter, LatencyTracker, HedgePolicy, SingleFlight,
+    get_client, set_client, deadline, get_time_left, check_deadline, submit)
+from .metrics import FetchEvent
+
 
 LOGGER = logging.getLogger(__name__)
 
 # logging.basicConfig(level=logging.DEBUG)
 # logging.getLogger('requests').setLevel(logging.ERROR)
 
+# Response validators headers mapped to conditional request headers.
+VALIDATORS = {
+    'ETag': 'If-None-Match',
+    'Last-Modified': 'If-Modified-Since',
+}
+
 
 def str_sub(string, **kwargs):
     tpl = Template(string)
     return tpl.safe_substitute(**kwargs)
 
 
+class ClassTextExtractor(HTMLParser):
+    """Streaming HTML parser collecting texts of elements
+    having `cls_item` class within elements having `cls_row` class.
+
+    Works as a fast equivalent of `soup.select('.row .item')[0].text`
+    for every row, without building a document tree.
+
+    """
+
+    def __init__(self, cls_row, cls_item):
+        super().__init__()
+        self.cls_row = cls_row
+        self.cls_item = cls_item
+
+        self.texts = []
+
+        self._row_tag = None
+        self._row_depth = 0
+        self._row_done = False
+        self._item_tag = None
+        self._item_depth = 0
+        self._item_chunks = []
+
+    @classmethod
+    def extract(cls, html, cls_row, cls_item):
+        """Returns a list of texts from the given HTML.
+
+        :param str html:
+        :param str cls_row:
+        :param str cls_item:
+        :rtype: list
+        """
+        parser = cls(cls_row, cls_item)
+        parser.feed(html)
+        parser.close()
+        return parser.texts
+
+    @classmethod
+    def _has_class(cls, attrs, cls_name):
+        for name, value in attrs:
+            if name == 'class' and value and cls_name in value.split():
+                return True
+        return False
+
+    def handle_starttag(self, tag, attrs):
+
+        if self._item_tag:
+            if tag == self._item_tag:
+                self._item_depth += 1
+            return
+
+        if self._row_tag:
+            if tag == self._row_tag:
+                self._row_depth += 1
+
+            if not self._row_done and self._has_class(attrs, self.cls_item):
+                self._item_tag = tag
+                self._item_depth = 1
+
+        elif self._has_class(attrs, self.cls_row):
+            self._row_tag = tag
+            self._row_depth = 1
+            self._row_done = False
+
+    def handle_endtag(self, tag):
+
+        if self._item_tag:
+            if tag == self._item_tag:
+                self._item_depth -= 1
+
+                if not self._item_depth:
+                    self.texts.append(''.join(self._item_chunks))
+                    self._item_tag = None
+                    self._item_chunks = []
+                    self._row_done = True  # Only the first item in a row is considered.
+            return
+
+        if self._row_tag and tag == self._row_tag:
+            self._row_depth -= 1
+
+            if not self._row_depth:
+                self._row_tag = None
+
+    def handle_data(self, data):
+        if self._item_tag:
+            self._item_chunks.append(data)
+
+
 class DataFetcher(object):
 
-    def __init__(self, url, params=None):
+    def __init__(self, url, params=None, client=None, endpoint=None):
+        """
+        :param str url:
+        :param dict params: Query string parameters.
+        :param HttpClient client: HTTP client to use. Default shared client is used if not set.
+        :param str endpoint: Endpoint name (see `ENDPOINT_` constants in settings).
+            Used to apply per-endpoint policies (e.g. caching).
+        """
         self.url = url
         self.params = params
+        self.endpoint = endpoint
+        self._client = client
+
+        self.status = None
+        """Status code of the last response. None if no request has been made
+        (e.g. contents are taken from cache).
+
+        """
+
+    @property
+    def client(self):
+        """
+        :rtype: HttpClient
+        """
+        return self._client or get_client()
+
+    def fetch_data(self, req_timeout=0, stream=False, headers=None):
+        """Performs the request and returns the response.
+
+        Request timeouts are shortened to fit into the current deadline (see `deadline()`).
+
+        :param int req_timeout: Seconds to wait before the request.
+        :param bool stream: Do not download response body at once.
+        :param dict headers: Additional request headers.
+        :rtype: requests.Response
+        :raises RequestTimeout: If server doesn't respond in time.
+        :raises DeadlineExceeded: If deadline is exceeded.
+        """
+        with self._instrument('data') as event:
+            return self._fetch_data(event, req_timeout, stream, headers)
 
-    def fetch_data(self, req_timeout=0):
+    def _call_hooks(self, method, event):
+        for hook in self.client.hooks:
+            try:
+                getattr(hook, method)(event)
+
+            except Exception:
+                LOGGER.exception('Fetch hook %r failed', hook)
+
+    @contextmanager
+    def _instrument(self, kind):
+        # Fetch event is passed to hooks before and after the fetch.
+        event = FetchEvent(self.url, self.endpoint, kind)
+        started = monotonic()
+
+        self._call_hooks('fetch_started', event)
+
+        try:
+            yield event
+
+        except Exception as e:
+            event.error = e
+            raise
+
+        finally:
+            event.duration = monotonic() - started
+            self._call_hooks('fetch_finished', event)
+
+    def _fetch_data(self, event, req_timeout=0, stream=False, headers=None):
 
         if req_timeout:
             sleep(req_timeout)
 
-        LOGGER.debug('Fetching data from %s ...', self.url)
+        client = self.client
+        limiter = client.limiter
+        url = self.url
+        host = urlsplit(url).hostname
+
+        attempt = 0
+
+        while True:
+            started = monotonic()
+            limiter.acquire(host, timeout=check_deadline(url))
+            time_left = check_deadline(url)
+            requested = monotonic()
+            event.wait_time += requested - started
+
+            LOGGER.debug('Fetching data from %s ...', url)
+
+            try:
+                response = client.fetch(
+                    url, self.params, endpoint=self.endpoint,
+                    stream=stream, headers=headers, timeout=client.get_timeout(time_left))
+
+            except requests.Timeout as e:
+                check_deadline(url)
+                raise RequestTimeout('Request timed out: %s' % e, url)
+
+            finally:
+                event.network_time += monotonic() - requested
+
+            response.encoding = 'utf-8'
+            event.status = self.status = response.status_code
+
+            if response.status_code != 429:  # 429 Too Many Requests
+                break
+
+            response.close()
+
+            event.throttled += 1
+            attempt += 1
 
-        response = requests.get(self.url, self.params, headers={
-            'User-Agent': 'Valve/Steam HTTP Client 1.0 (tenfoot)',
-        })
-        response.encoding = 'utf-8'
+            if attempt > client.retries:
+                raise TooManyRequests('Request limit hit %s times' % attempt, url)
 
-        if response.status_code == 429:  # 429 Too Many Requests
-            pause_sec = 60
-            LOGGER.debug('Request limit hit for %s. Waiting for %d seconds ...', self.url, pause_sec)
-            response = self.fetch_data(pause_sec)
+            pause_sec = client.get_retry_pause(response, attempt)
+            LOGGER.debug('Request limit hit for %s. Waiting for %.2f seconds ...', url, pause_sec)
+
+            # Other requests to the same host are held as well.
+            limiter.pause(host, pause_sec)
+            event.retries += 1
+
+        if not stream:
+            event.size = len(response.content)
 
         return response
 
+    @property
+    def cache_key(self):
+        """Cache key for the request. That is full URL including query string.
+
+        :rtype: str
+        """
+        return requests.Request('GET', self.url, params=self.params).prepare().url
+
+    @classmethod
+    def get_validators(cls, response):
+        """Returns validators (`ETag`, `Last-Modified` headers) from the response.
+
+        :param requests.Response response:
+        :rtype: dict
+        """
+        headers = response.headers
+        return {name: headers[name] for name in VALIDATORS if headers.get(name)}
+
+    @classmethod
+    def get_conditional_headers(cls, validators):
+        """Returns conditional request headers for the given validators.
+
+        :param dict validators:
+        :rtype: dict
+        """
+        return {VALIDATORS[name]: value for name, value in validators.items() if name in VALIDATORS}
+
+    def _get_cached(self, key=None):
+        # Returns (cache, ttl, key, entry) tuple for the request.
+        client = self.client
+        cache = client.cache
+        ttl = cache and client.cache_ttls.get(self.endpoint)
+
+        if not ttl:
+            return None, None, None, None
+
+        key = key or self.cache_key
+
+        return cache, ttl, key, cache.get_entry(key)
+
+    def _fetch_content(self, event, key=None):
+        # Returns (content, validators) tuple. Validators are only
+        # returned for cached responses, since those may be revalidated.
+        cache, ttl, key, entry = self._get_cached(key)
+        headers = None
+
+        if entry is not None:
+
+            if not entry.expired:
+                LOGGER.debug('Cached data used for %s', key)
+                event.cached = True
+                event.size = len(entry.content)
+                return entry.content, entry.validators
+
+            headers = self.get_conditional_headers(entry.validators)
+
+        response = self._fetch_data(event, headers=headers)
+        status = response.status_code
+
+        if entry is not None and status == 304:  # 304 Not Modified
+            LOGGER.debug('Cached data revalidated for %s', key)
+            event.cached = event.revalidated = True
+            validators = dict(entry.validators, **self.get_validators(response))
+            cache.set(key, entry.content, ttl, validators)
+            return entry.content, validators
+
+        content = response.content
+        validators = None
+
+        if ttl and status == 200:
+            validators = self.get_validators(response)
+            cache.set(key, content, ttl, validators)
+
+        return content, validators
+
+    def fetch_content(self):
+        """Returns response contents, from cache if available.
+
+        Expired cached contents having validators are revalidated
+        with a conditional request.
+
+        :rtype: bytes
+        """
+        with self._instrument('content') as event:
+            return self._fetch_content(event)[0]
+
+    def iter_content(self, chunk_size=65536):
+        """Generates response contents chunk by chunk as it is downloaded,
+        or at once if it's cached.
+
+        :param int chunk_size:
+        :rtype: Iterable[bytes]
+        """
+        with self._instrument('stream') as event:
+            yield from self._iter_content(event, chunk_size)
+
+    def _iter_content(self, event, chunk_size):
+        cache, ttl, key, entry = self._get_cached()
+        headers = None
+
+        if entry is not None:
+
+            if not entry.expired:
+                LOGGER.debug('Cached data used for %s', key)
+                event.cached = True
+                event.size = len(entry.content)
+                yield entry.content
+                return
+
+            headers = self.get_conditional_headers(entry.validators)
+
+        chunks = []
+
+        with self._fetch_data(event, stream=True, headers=headers) as response:
+            status = response.status_code
+
+            if entry is not None and status == 304:  # 304 Not Modified
+                LOGGER.debug('Cached data revalidated for %s', key)
+                event.cached = event.revalidated = True
+                event.size = len(entry.content)
+                cache.set(key, entry.content, ttl, dict(entry.validators, **self.get_validators(response)))
+                yield entry.content
+                return
+
+            try:
+                chunks_iter = response.iter_content(chunk_size)
+
+                while True:
+                    started = monotonic()
+                    chunk = next(chunks_iter, None)
+                    event.network_time += monotonic() - started
+
+                    if chunk is None:
+                        break
+
+                    event.size += len(chunk)
+                    ttl and chunks.append(chunk)
+                    yield chunk
+                    check_deadline(self.url)
+
+            except requests.ConnectionError as e:
+                # Read timeouts are reported as connection errors while streaming.
+                if not (e.args and isinstance(e.args[0], ReadTimeoutError)):
+                    raise
+
+                check_deadline(self.url)
+                raise RequestTimeout('Request timed out: %s' % e, self.url)
+
+        if ttl and status == 200:
+            cache.set(key, b''.join(chunks), ttl, self.get_validators(response))
+
+    def _fetch_parsed(self, kind, parse):
+        # Identical requests in flight share one network call and one parsed result.
+        # Parsed results of revalidated (not modified) contents are reused.
+        client = self.client
+        key = (kind, self.cache_key)
+
+        def parse_timed(content, event):
+            started = monotonic()
+            parsed = parse(content)
+            event.parse_time = monotonic() - started
+            return parsed
+
+        def fetch():
+            with self._instrument(kind) as event:
+                content, validators = self._fetch_content(event, key[1])
+
+                if not validators:
+                    return parse_timed(content, event)
+
+                parsed = client.get_parsed(key, validators)
+
+                if parsed is None:
+                    parsed = parse_timed(content, event)
+                    client.set_parsed(key, validators, parsed)
+
+                return parsed
+
+        flights = client.flights
+
+        if flights is None:
+            return fetch()
+
+        led = []
+
+        def fetch_leading():
+            led.append(True)
+            return fetch()
+
+        while True:
+            try:
+                return flights.do(key, fetch_leading, timeout=check_deadline(key[1]))
+
+            except FutureTimeoutError:
+                raise DeadlineExceeded('Deadline exceeded while waiting for request in flight', key[1])
+
+            except DeadlineExceeded:
+                if led:
+                    raise
+
+                # Request in flight has exceeded the deadline of the caller who made it,
+                # which is not ours: retry unless our own deadline is exceeded as well.
+                check_deadline(key[1])
+
     def fetch_json(self):
-        json = self.fetch_data().json()
-        return json
+        # Parsed straight from response bytes, no intermediate text copy.
+        return self._fetch_parsed('json', json_loads)
 
     def fetch_xml(self):
-        data = self.fetch_data()
-        xml = ElementTree.fromstring(data.text.encode('utf8'))
-        return xml
+        # Parsed straight from response bytes respecting declared encoding.
+        return self._fetch_parsed('xml', ElementTree.fromstring)
+
+    def iter_xml(self, tag):
+        """Generates XML elements with the given tag as soon as they are
+        parsed from response contents streamed chunk by chunk.
+
+        Elements are cleared after being processed,
+        so the whole document is never held in memory.
+
+        :param str tag:
+        :rtype: Iterable[ElementTree.Element]
+        """
+        parser = ElementTree.XMLPullParser(events=('end',))
+
+        def read_events():
+            for _, element in parser.read_events():
+                if element.tag == tag:
+                    yield element
+                    element.clear()
+
+        for chunk in self.iter_content():
+            parser.feed(chunk)
+            yield from read_events()
+
+        parser.close()
+        yield from read_events()
 
     @classmethod
     def get_soup(cls, data):
         return BeautifulSoup(data, 'html5lib')
+
+
+class AsyncDataFetcher(object):
+    """Asynchronous counterpart of DataFetcher.
+
+    Requests are performed by client's pooled session within its bounded executor,
+    so that many fetches may be awaited on one event loop while no more
+    than `HttpClient.concurrency` of them hit the network at once.
+
+    """
+
+    def __init__(self, url, params=None, client=None, endpoint=None):
+        self.fetcher = DataFetcher(url, params=params, client=client, endpoint=endpoint)
+
+    @property
+    def client(self):
+        """
+        :rtype: HttpClient
+        """
+        return self.fetcher.client
+
+    async def _run(self, func):
+        loop = asyncio.get_running_loop()
+        # Run within a copy of the current context to respect deadline.
+        return await loop.run_in_executor(self.client.executor, copy_context().run, func)
+
+    async def _coalesce(self, kind, func):
+        # Identical fetches awaited on the same loop share one executor job,
+        # so that waiting for a request in flight doesn't occupy a worker thread.
+        client = self.client
+
+        if client.flights is None:
+            return await self._run(func)
+
+        flights = client._flights_async
+        key = (asyncio.get_running_loop(), kind, self.fetcher.cache_key)
+
+        def forget(future_):
+            if flights.get(key) is future_:
+                del flights[key]
+
+        while True:
+            future = flights.get(key)
+            leader = future is None
+
+            if leader:
+                # Request is made within the context (and deadline) of the caller who made it.
+                future = flights[key] = asyncio.ensure_future(self._run(func))
+                future.add_done_callback(forget)
+
+            # One of the callers being cancelled doesn't cancel the others.
+            time_left = check_deadline(key[2])
+
+            try:
+                return await asyncio.wait_for(asyncio.shield(future), time_left)
+
+            except asyncio.TimeoutError:
+                raise DeadlineExceeded('Deadline exceeded while waiting for request in flight', key[2])
+
+            except DeadlineExceeded:
+                if leader:
+                    raise
+
+                # Deadline of the caller who made the request is exceeded, not ours: retry.
+                forget(future)
+                check_deadline(key[2])
+
+    async def fetch_data(self):
+        return await self._run(self.fetcher.fetch_data)
+
+    async def fetch_json(self):
+        return await self._coalesce('json', self.fetcher.fetch_json)
+
+    async def fetch_xml(self):
+        return await self._coalesce('xml', self.fetcher.fetch_xml)
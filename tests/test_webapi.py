@@ -0,0 +1,1348 @@
+import json
+from os import path
+from time import monotonic, sleep
+
+import pytest
+import requests
+
+from steampak.webapi.history import PriceHistory
+from steampak.webapi.metrics import MetricsRegistry, FetchHook, Histogram
+from steampak.webapi.exceptions import TooManyRequests, ResponseError, RequestTimeout, DeadlineExceeded
+from steampak.webapi.cache import MemoryCache, FileCache
+from steampak.webapi.http import (
+    HttpClient, RateLimiter, LatencyTracker, HedgePolicy, get_client, set_client, deadline, get_time_left,
+    check_deadline)
+from steampak.webapi.utils import DataFetcher, AsyncDataFetcher, ClassTextExtractor
+from steampak.webapi.resources.apps import Application, AppDetailsResolver
+from steampak.webapi.resources.market import (
+    Item, Card, parse_money, normalize_price_data, TAG_ITEM_CLASS_CARD, TAG_ITEM_CLASS_GEM, TAG_ITEM_CLASS_BOOSTER, TAG_CARDBORDER_FOIL)
+from steampak.webapi.resources.user import User, InventoryIndex, InventorySnapshot
+
+
+PATH_FIXTURES = path.join(path.dirname(__file__), 'fixtures')
+
+
+def read_fixture(filename):
+    with open(path.join(PATH_FIXTURES, filename), encoding='utf-8') as f:
+        return f.read()
+
+
+class FakeClient(HttpClient):
+    """Client responding with prepared data instead of going to network."""
+
+    def __init__(self, responses=None, **kwargs):
+        kwargs.setdefault('limiter', RateLimiter({}))
+        super().__init__(**kwargs)
+        self.responses = responses or {}
+        self.requested = []
+        self.requested_headers = []
+        self.requested_timeouts = []
+
+    def get(self, url, params=None, **kwargs):
+        self.requested.append((url, params))
+        self.requested_headers.append(kwargs.get('headers') or {})
+        self.requested_timeouts.append(kwargs.get('timeout'))
+
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+
+        content = ''
+        for url_part, content_ in self.responses.items():
+            if url_part in url:
+                content = content_
+                break
+
+        if callable(content):
+            content = content(url, params)
+
+        if isinstance(content, list):
+            # Sequence of responses.
+            content = content.pop(0) if len(content) > 1 else content[0]
+
+        if isinstance(content, tuple):
+            # (status, content[, headers])
+            status, content, headers = (content + ({},))[:3]
+            response.status_code = status
+            response.headers.update(headers)
+
+        if response.status_code == 429:
+            response.headers['Retry-After'] = '0'
+
+        if not isinstance(content, (str, bytes)):
+            content = json.dumps(content)
+
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+
+        response._content = content
+        response._content_consumed = True
+
+        return response
+
+
+@pytest.fixture
+def client():
+    client = FakeClient()
+    client_default = get_client()
+    set_client(client)
+    Application.registry.clear()
+    yield client
+    set_client(client_default)
+
+
+@pytest.fixture
+def run_cli(client, monkeypatch):
+    from click.testing import CliRunner
+    from steampak.cli import start
+
+    def get_client_(hooks=None, **kwargs):
+        client.hooks.extend(hooks or [])
+        return client
+
+    monkeypatch.setattr('steampak.cli.HttpClient', get_client_)
+
+    def run_cli_(*args):
+        result = CliRunner().invoke(start, ['--no-cache'] + list(args), obj={})
+        assert result.exit_code == 0, result.output
+        return result.output
+
+    return run_cli_
+
+
+def cards_html(*titles):
+    return ''.join(
+        '<a class="market_listing_row_link"><span class="market_listing_item_name">%s</span></a>' % title
+        for title in titles)
+
+
+def test_client_pooling():
+    client = HttpClient(pool_size=3, headers={'X-Some': 'thing'})
+
+    session = client.session
+    assert session is client.session
+    assert session.headers['X-Some'] == 'thing'
+    assert session.headers['Connection'] == 'keep-alive'
+    assert session.get_adapter('https://steamcommunity.com')._pool_maxsize == 3
+
+    client.close()
+    assert client.session is not session
+
+
+def test_client_shared(client):
+    client.responses['appdetails'] = {'1': {'success': True, 'data': {'name': 'Some'}}}
+
+    assert DataFetcher('http://some').client is client
+
+    app = Application('1')
+    assert app.title == 'Some'
+
+    item = Item('1', 'Thing')
+    assert item.client is None
+    assert item.app.client is None
+
+    own_client = FakeClient(responses=client.responses)
+    item = Item(app, 'Thing', client=own_client)
+    assert item.client is own_client
+
+    user = User('idle', client=own_client)
+    assert user.client is own_client
+
+    booster = Card.get_booster(Application('1', client=own_client))
+    assert booster.client is own_client
+    assert booster.title == 'Some Booster Pack'
+    assert len(own_client.requested) == 1
+
+
+def test_async(client):
+    import asyncio
+
+    client.responses.update({
+        'appdetails': {'1': {'success': True, 'data': {'name': 'Some'}}},
+        'priceoverview': {'success': True, 'lowest_price': '1,5 pуб.', 'median_price': '2', 'volume': '3'},
+        'render': {'results_html': (
+            '<a class="market_listing_row_link"><span class="market_listing_item_name">Two</span></a>'
+            '<a class="market_listing_row_link"><span class="market_listing_item_name">One</span></a>')},
+        'games': '<gamesList><games><game><appID>1</appID><name>Some</name></game></games></gamesList>',
+        'inventory': {'success': True, 'rgInventory': {}, 'rgDescriptions': {}},
+    })
+
+    async def run():
+        app = Application('1')
+        user = User('idle')
+
+        (cards, booster), prices, games, inventory = await asyncio.gather(
+            app.get_cards_async(),
+            asyncio.gather(*[Item('1', str(idx)).get_price_data_async('USD') for idx in range(20)]),
+            user.get_games_owned_async(),
+            user._get_inventory_raw_async(),
+        )
+        return cards, booster, prices, games, inventory
+
+    cards, booster, prices, games, inventory = asyncio.run(run())
+
+    assert [card.title for card in cards.values()] == ['One', 'Two']
+    assert booster.title == 'Some Booster Pack'
+    assert len(prices) == 20
+    assert str(prices[0]['lowest_price']) == '1.5'
+    assert prices[0]['currency'] == 'USD'
+    assert games == {'1': {'appid': '1', 'title': 'Some'}}
+    assert inventory['success']
+    assert len(client.requested) == 24
+
+
+def test_rate_limiter(monkeypatch):
+    now = [100]
+    monkeypatch.setattr('steampak.webapi.http.monotonic', lambda: now[0])
+
+    limiter = RateLimiter({'a': (2, 3)})
+
+    assert limiter.reserve('b') == 0
+    assert [limiter.reserve('a') for _ in range(4)] == [0, 0, 0, 0.5]
+
+    now[0] += 1
+    assert limiter.reserve('a') == 0
+
+    limiter.pause('b', 10)
+    assert limiter.reserve('b') == 10
+    assert limiter.reserve('a') == 0.5
+
+
+def test_rate_limiter_timeout(monkeypatch):
+    now = [100]
+    monkeypatch.setattr('steampak.webapi.http.monotonic', lambda: now[0])
+
+    limiter = RateLimiter({'a': (1, 1)})
+    limiter.acquire('a', timeout=0.5)
+
+    # Rejected requests do not take tokens.
+    for _ in range(5):
+        with pytest.raises(DeadlineExceeded):
+            limiter.acquire('a', timeout=0.5)
+
+    assert limiter.reserve('a') == 1
+
+
+def test_retries(client):
+    client.responses['priceoverview'] = [(429, ''), (429, ''), {'success': False}]
+
+    assert Item('1', 'one').get_price_data() == {}
+    assert len(client.requested) == 3
+
+    client.retries = 1
+    client.responses['priceoverview'] = [(429, ''), (429, ''), {'success': False}]
+
+    with pytest.raises(TooManyRequests):
+        Item('1', 'one').get_price_data()
+
+
+def test_retry_pause():
+    response = requests.Response()
+    response.headers['Retry-After'] = '12'
+    assert HttpClient.get_retry_pause(response, 1) == 12
+
+    response.headers['Retry-After'] = 'Wed, 21 Oct 2015 07:28:00 GMT'
+    assert HttpClient.get_retry_pause(response, 1) == 0
+
+    del response.headers['Retry-After']
+    assert 0 <= HttpClient.get_retry_pause(response, 10) <= 120
+
+
+@pytest.mark.parametrize('cache_cls', [MemoryCache, FileCache])
+def test_cache(cache_cls, tmpdir, monkeypatch):
+    now = [100]
+    monkeypatch.setattr('steampak.webapi.cache.time', lambda: now[0])
+
+    args = [str(tmpdir)] if cache_cls is FileCache else []
+
+    cache = cache_cls(*args, size_max=1000)
+    assert cache.get('a') is None
+
+    cache.set('a', b'a' * 100, 10)
+    cache.set('b', b'b' * 100, 100)
+    assert cache.get('a') == b'a' * 100
+
+    now[0] += 50
+    assert cache.get('a') is None
+    assert cache.get('b') == b'b' * 100
+
+    cache.delete('b')
+    assert cache.get('b') is None
+
+    # Size based eviction.
+    for idx in range(30):
+        cache.set(str(idx), bytes(range(200)), 100)
+
+    assert cache.size <= 1000
+    assert cache.get('29') == bytes(range(200))
+    assert len([idx for idx in range(30) if cache.get(str(idx))]) <= 5
+
+    cache.clear()
+    assert cache.size == 0
+    assert cache.get('29') is None
+
+    # Expired contents with validators are kept for revalidation.
+    cache.set('v', b'v', 10, {'ETag': '"x"'})
+    cache.set('n', b'n', 10)
+    now[0] += 20
+    assert cache.get('v') is None
+    assert cache.get_entry('n') is None
+
+    entry = cache.get_entry('v')
+    assert entry.expired
+    assert entry.content == b'v'
+    assert entry.validators == {'ETag': '"x"'}
+
+
+def test_file_cache_concurrent(tmpdir):
+    from concurrent.futures import ThreadPoolExecutor
+
+    cache = FileCache(str(tmpdir))
+
+    def write(idx):
+        cache.set('same', bytes(range(idx % 200)) * 10, 100)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(write, range(200)))
+
+    assert cache.size == cache._get_size()
+    assert not tmpdir.listdir(lambda item: item.ext == '.tmp')
+
+
+def test_file_cache_unusable(tmpdir, monkeypatch):
+    # Cache directory can not be created: caching is off.
+    blocker = tmpdir.join('file')
+    blocker.write('')
+
+    cache = FileCache(str(blocker.join('cache')))
+    assert not cache.enabled
+    cache.set('a', b'a', 100)
+    assert cache.get('a') is None
+    cache.clear()
+
+    # Write failures are not fatal.
+    cache = FileCache(str(tmpdir.join('cache')))
+
+    def fail(*args, **kwargs):
+        raise OSError('no space left')
+
+    monkeypatch.setattr('steampak.webapi.cache.mkstemp', fail)
+    cache.set('a', b'a', 100)
+    assert cache.get('a') is None
+    assert cache.size == 0
+
+
+def test_fetch_cached(client):
+    client.cache = MemoryCache()
+    client.responses['priceoverview'] = {'success': True, 'lowest_price': '1'}
+    client.responses['inventory'] = {'success': True}
+
+    item = Item('1', 'one')
+    assert item.get_price_data('USD')['lowest_price'] == 1
+    assert item.get_price_data('USD')['lowest_price'] == 1
+    assert item.get_price_data('EUR')['lowest_price'] == 1
+    assert len(client.requested) == 2
+
+    # Inventory has no TTL set, so never cached.
+    user = User('idle')
+    user._get_inventory_raw()
+    user._get_inventory_raw()
+    assert len(client.requested) == 4
+
+
+def test_cli_card_prices(client, run_cli):
+    client.responses.update({
+        'appdetails': {'1': {'success': True, 'data': {'name': 'Some'}}},
+        'render': {'results_html': cards_html('Two', 'One', 'Three')},
+        'priceoverview': {'success': True, 'lowest_price': '$1.50'},
+    })
+
+    output = run_cli('app', '1', 'get-card-prices', '--currency', 'USD', '--workers', '3')
+
+    assert 'One: 1.50 USD\nThree: 1.50 USD\nTwo: 1.50 USD\n' in output
+    assert 'Price avg 1 card: 1.50' in output
+    assert 'Booster price: Some Booster Pack: 1.50 USD' in output
+    assert len(client.requested) == 6
+
+    # Unsuccessful price lookups are not repeated.
+    client.requested.clear()
+    client.responses['priceoverview'] = {'success': False}
+
+    output = run_cli('app', '1', 'get-card-prices', '--currency', 'USD', '--workers', '3')
+    assert 'One: 0 None\n' in output
+    assert len([url for url, _ in client.requested if 'priceoverview' in url]) == 4
+
+
+def test_cli_stats(client, run_cli, tmpdir):
+    import pstats
+
+    client.responses.update({
+        'appdetails': {'1': {'success': True, 'data': {'name': 'Some'}}},
+        'render': {'results_html': cards_html('Two', 'One')},
+        'priceoverview': {'success': True, 'lowest_price': '$1.50'},
+    })
+
+    profile = str(tmpdir.join('cli.prof'))
+
+    output = run_cli('--stats', '--profile', profile, 'app', '1', 'get-card-prices')
+
+    assert 'One: 1.50' in output
+    assert '* Wall time:' in output
+    assert 'parse html' in output
+    assert 'output' in output
+    assert 'appdetails       fetches: 1, requests: 1' in output
+    assert 'priceoverview    fetches: 3, requests: 3' in output
+    assert 'market_search    fetches: 1, requests: 1' in output
+    assert 'Profile saved into' in output
+
+    assert pstats.Stats(profile).total_calls
+
+    from steampak.webapi.metrics import phases
+    assert not phases.enabled
+    assert phases.get('parse_html')[1] == 1
+    assert phases.get('normalize_prices')[1] == 3
+
+
+def test_bulk_prices(client):
+    client.responses['priceoverview'] = {'success': True, 'lowest_price': '10'}
+
+    items = [Item('1', 'one'), Card('1', 'two'), Item('1', 'one'), Item(Application('2'), 'one')]
+
+    prices = Item.get_prices(items, 'USD', workers=2)
+
+    assert list(prices.keys()) == ['1-one', '1-two', '2-one']
+    assert prices['1-one']['currency'] == 'USD'
+    assert items[2].price_lowest == 10
+    assert len(client.requested) == 3
+
+
+def test_bulk_prices_failed(client):
+
+    def respond(url, params):
+        if params['market_hash_name'] == '1-0':
+            return (500, 'not a json')
+        sleep(0.01)
+        return {'success': True, 'lowest_price': '10'}
+
+    client.responses['priceoverview'] = respond
+
+    items = [Item('1', str(idx)) for idx in range(300)]
+
+    with pytest.raises(ValueError):
+        list(Item.iter_prices(items, 'USD', workers=4))
+
+    sleep(0.1)
+    assert len(client.requested) <= 8
+
+    # Consumer stopping early.
+    client.requested.clear()
+    client.responses['priceoverview'] = {'success': True, 'lowest_price': '10'}
+
+    prices = Item.iter_prices(items[1:], 'USD', workers=4)
+    assert next(prices).price_lowest == 10
+    prices.close()
+
+    sleep(0.1)
+    assert len(client.requested) <= 8
+
+
+def test_card_names_extraction(monkeypatch):
+    html = json.loads(read_fixture('market_search_render.json'))['results_html']
+
+    names = Application._get_card_names(html)
+    assert len(names) == 15
+    assert names[0] == 'Gordon Freeman'
+    assert names[-1] == 'Headcrab & Friends'
+
+    assert Application._get_card_names('<div>nothing</div>') == []
+
+    # Fallback to html5lib.
+    def fail(*args):
+        raise ValueError
+
+    monkeypatch.setattr(ClassTextExtractor, 'extract', fail)
+    assert Application._get_card_names(html) == names
+
+
+def test_cards_pagination(client):
+
+    def render(url, params):
+        start, count = params['start'], params['count']
+        return {
+            'success': True, 'total_count': 25,
+            'results_html': cards_html(*['card %02d' % idx for idx in range(start, min(start + count, 25))])}
+
+    client.responses.update({
+        'appdetails': {'1': {'success': True, 'data': {'name': 'Some'}}},
+        'render': render,
+    })
+
+    app = Application('1')
+    cards = app.iter_cards(page_size=10)
+    assert next(cards).title == 'card 00'
+    assert len(client.requested) == 1
+
+    assert len(list(cards)) == 24
+    assert [params['start'] for url, params in client.requested] == [0, 10, 20]
+
+    cards, booster = app.get_cards()
+    assert len(cards) == 25
+
+    import asyncio
+    cards, booster = asyncio.run(app.get_cards_async(page_size=7))
+    assert list(cards.values())[-1].title == 'card 24'
+    assert booster.title == 'Some Booster Pack'
+
+
+def test_app_details_batching(client, monkeypatch):
+    monkeypatch.setattr(Application, 'resolver', AppDetailsResolver())
+
+    client.responses['appdetails'] = lambda url, params: {
+        appid: {'success': True, 'data': {'name': 'app %s' % appid}}
+        for appid in url.split('appids=')[1].split(',')}
+
+    apps = [Application(str(appid)) for appid in range(5)]
+    Application.resolver.add(*apps[1:])
+
+    assert apps[0].title == 'app 0'
+    assert [app.title for app in apps] == ['app %s' % idx for idx in range(5)]
+    assert len(client.requested) == 1
+    assert client.requested[0][1] == {'filters': 'basic,categories'}
+
+
+def test_app_details_batch_rejected(client, monkeypatch):
+    monkeypatch.setattr(Application, 'resolver', AppDetailsResolver())
+
+    def details(url, params):
+        appids = url.split('appids=')[1].split(',')
+        if len(appids) > 1:
+            return 400, 'null'
+        return {appids[0]: {'success': appids[0] != '3', 'data': {'name': 'app %s' % appids[0]}}}
+
+    client.responses['appdetails'] = details
+
+    apps = [Application(str(appid)) for appid in range(5)]
+    Application.prefetch(apps)
+
+    assert len(client.requested) == 6
+    assert not Application.resolver.batching
+    assert apps[4].title == 'app 4'
+    assert apps[3].title == '<unresolved 3>'
+
+    apps = [Application(str(appid)) for appid in range(5, 7)]
+    Application.prefetch(apps)
+    assert len(client.requested) == 9  # No more batches for a while once rejected.
+
+    # Batching is tried again later.
+    now = [monotonic() + Application.resolver.batch_off]
+    monkeypatch.setattr('steampak.webapi.resources.apps.monotonic', lambda: now[0])
+    assert Application.resolver.batching
+
+    apps = [Application(str(appid)) for appid in range(7, 9)]
+    Application.prefetch(apps)
+    assert len(client.requested) == 12
+
+
+def test_app_details_batch_failed(client, monkeypatch):
+    monkeypatch.setattr(Application, 'resolver', AppDetailsResolver())
+
+    def details(url, params):
+        appids = url.split('appids=')[1].split(',')
+        if len(appids) > 2:
+            return 500, '<html>Server error</html>'
+        # Batch response lacking some of the applications.
+        return 200, {appid: {'success': True, 'data': {'name': 'app %s' % appid}} for appid in appids[:1]}, {
+            'ETag': '"x"'}
+
+    client.responses['appdetails'] = details
+
+    apps = [Application(str(appid)) for appid in range(3)]
+    Application.prefetch(apps)
+    assert [app.title for app in apps] == ['app 0', 'app 1', 'app 2']
+    assert len(client.requested) == 4
+    assert Application.resolver.batching  # Not an explicit rejection.
+
+    apps = [Application(str(appid)) for appid in range(3, 5)]
+    Application.prefetch(apps)
+    assert [app.title for app in apps] == ['app 3', 'app 4']
+    assert len(client.requested) == 6  # Only missing application is requested separately.
+    assert Application.resolver.batching
+
+    # Parsed batch response (shared with other callers) is left intact.
+    client.cache = MemoryCache()
+    apps = [Application(str(appid)) for appid in range(5, 7)]
+    Application.prefetch(apps)
+    assert [app.title for app in apps] == ['app 5', 'app 6']
+    assert [list(parsed) for _, parsed in client._parsed.values()] == [['5'], ['6']]
+
+
+def test_app_details_clients(client, monkeypatch):
+    monkeypatch.setattr(Application, 'resolver', AppDetailsResolver())
+
+    client.responses['appdetails'] = lambda url, params: {
+        appid: {'success': True, 'data': {'name': 'app %s' % appid}}
+        for appid in url.split('appids=')[1].split(',')}
+
+    own_client = FakeClient(responses=client.responses)
+
+    apps = [Application('1'), Application('2', client=own_client), Application('3')]
+    Application.prefetch(apps)
+
+    assert [app.title for app in apps] == ['app 1', 'app 2', 'app 3']
+    assert [url.split('appids=')[1] for url, _ in client.requested] == ['1,3']
+    assert [url.split('appids=')[1] for url, _ in own_client.requested] == ['2']
+
+
+def test_app_interning(client):
+    client.responses['appdetails'] = {'1': {'success': True, 'data': {'name': 'Some'}}}
+
+    app = Application('1')
+    assert Application(1) is app
+    assert Item(1, 'one').app is app
+    assert Card.get_booster('1').app is app
+    assert Application('1', client=FakeClient()) is not app
+    assert len(client.requested) == 1
+
+    app.invalidate()
+    assert app.title == 'Some'
+    assert len(client.requested) == 2
+
+    Application.invalidate_all()
+    assert not app._data_raw
+
+    del app
+    assert not Application.registry
+
+
+def inventory_page(url, params, total=5, classids=('1', '2', '667924416')):
+    """Paginated inventory stub: item N has asset ID N and one of `classids`."""
+    start = int(params.get('start_assetid', 0))
+    assetids = range(start + 1, min(start + params['count'], total) + 1)
+    assets = [
+        {'assetid': str(assetid), 'classid': classids[assetid % len(classids)], 'instanceid': '0', 'amount': '10'}
+        for assetid in assetids]
+
+    descriptions = [{
+        'classid': classid, 'instanceid': '0', 'name': 'Item %s' % classid, 'market_fee_app': int(classid),
+        'tags': [{'internal_name': TAG_ITEM_CLASS_CARD if classid == '1' else TAG_ITEM_CLASS_GEM}],
+    } for classid in sorted({asset['classid'] for asset in assets})]
+
+    page = {'success': 1, 'assets': assets, 'descriptions': descriptions, 'total_inventory_count': total}
+
+    if assetids and assetids[-1] < total:
+        page.update({'more_items': 1, 'last_assetid': str(assetids[-1])})
+
+    return page
+
+
+def test_cli_formats(client, run_cli):
+    import csv
+
+    client.responses.update({
+        'appdetails': {
+            '1': {'success': True, 'data': {'name': 'Some'}},
+            '2': {'success': True, 'data': {'name': 'Other'}},
+        },
+        'render': {'results_html': cards_html('Two', 'Item 1')},
+        'priceoverview': {'success': True, 'lowest_price': '$1.50'},
+        'idle/?xml=1': '<profile><steamID64>7656</steamID64></profile>',
+        '/inventory/': inventory_page,
+        'games': '<gamesList><games><game><appID>2</appID><name>Б</name></game>'
+                 '<game><appID>1</appID><name>A</name></game></games></gamesList>',
+    })
+
+    records = [
+        json.loads(line) for line in
+        run_cli('app', '1,2', 'get-card-prices', '--currency', 'USD', '--format', 'jsonl').splitlines()]
+
+    assert [record['record'] for record in records] == ['card', 'card', 'app', 'card', 'card', 'app', 'total']
+    assert records[0] == {
+        'record': 'card', 'appid': '1', 'app': 'Some', 'card': 'Item 1', 'market_hash': '1-Item 1',
+        'price': '1.50', 'currency': 'USD', 'owned': False}
+    assert records[2]['cards_total'] == 2
+    assert records[2]['booster_price'] == '1.50'
+    assert records[-1] == {'record': 'total', 'apps': 2, 'cards_total': 4, 'price_wanted': '6.00', 'price_owned': None}
+
+    rows = list(csv.DictReader(run_cli('user', 'idle', 'get-cards-stats', '--format', 'csv').splitlines()))
+
+    assert [row['record'] for row in rows] == ['card', 'card', 'app', 'total']
+    assert rows[0]['card'] == 'Item 1'
+    assert rows[0]['owned'] == 'True'
+    assert rows[1]['owned'] == 'False'
+    assert rows[2]['cards_owned'] == '1'
+    assert rows[2]['price_owned'] == '1.50'
+    assert rows[3]['price_owned'] == '1.50'
+    assert rows[3]['card'] == ''
+
+    records = [json.loads(line) for line in run_cli('user', 'idle', 'get-games', '--format', 'jsonl').splitlines()]
+    assert records == [
+        {'record': 'game', 'appid': '2', 'title': 'Б'},
+        {'record': 'game', 'appid': '1', 'title': 'A'},
+        {'record': 'total', 'games': 2},
+    ]
+
+
+def test_inventory_pages(client):
+    client.responses.update({
+        'idle/?xml=1': '<profile><steamID64>7656</steamID64></profile>',
+        '/inventory/': inventory_page,
+    })
+
+    user = User('idle')
+    assert user.steamid == '7656'
+
+    pages = list(user.iter_inventory_pages(page_size=2))
+    assert [[asset['assetid'] for asset in assets] for assets, _ in pages] == [['1', '2'], ['3', '4'], ['5']]
+
+    assert user.gems_total == 20
+    assert [(item.title, item.app.appid) for item in user.traverse_inventory()] == [
+        ('Item 1', '1'), ('Item 2', '2'), ('Item 667924416', '667924416')]
+
+    cards = list(user.traverse_inventory(TAG_ITEM_CLASS_CARD))
+    assert len(cards) == 1
+    assert isinstance(cards[0], Card)
+
+    assert len([url for url, _ in client.requested if 'xml' in url]) == 1
+
+    client.responses['nobody/?xml=1'] = '<response><error>The specified profile could not be found.</error></response>'
+
+    with pytest.raises(ResponseError):
+        User('nobody').steamid
+
+
+def test_inventory_index(client):
+
+    def description(classid, appid, *tags):
+        return {
+            'classid': classid, 'instanceid': '0', 'name': 'Item %s' % classid,
+            'market_fee_app': appid, 'tags': [{'internal_name': tag} for tag in tags]}
+
+    def asset(assetid, classid, amount=1):
+        return {'assetid': assetid, 'classid': classid, 'instanceid': '0', 'amount': str(amount)}
+
+    index = InventoryIndex.from_pages([
+        ([asset('1', '10'), asset('2', '10'), asset('3', '20')], [
+            description('10', 220, TAG_ITEM_CLASS_CARD, TAG_CARDBORDER_FOIL),
+            description('20', 220, TAG_ITEM_CLASS_CARD),
+        ]),
+        ([asset('4', '30'), asset('5', '10'), asset('6', '40', 5)], [
+            description('30', 440, TAG_ITEM_CLASS_CARD, TAG_CARDBORDER_FOIL),
+            description('10', 220, TAG_ITEM_CLASS_CARD, TAG_CARDBORDER_FOIL),
+            description('40', 440, TAG_ITEM_CLASS_BOOSTER),
+        ]),
+    ])
+
+    foil = index.filter(tag=TAG_CARDBORDER_FOIL, appid=220, item_class=TAG_ITEM_CLASS_CARD)
+    assert [(cls.classid, cls.amount) for cls in foil] == [('10', 3)]
+
+    assert len(index.filter(item_class=TAG_ITEM_CLASS_CARD)) == 3
+    assert len(index.filter(appid='440')) == 2
+    assert len(index.filter()) == 4
+    assert index.filter(tag='unknown') == []
+    assert index.get_amount('40') == 5
+    assert index.get_amount('50') == 0
+
+    client.responses.update({
+        'idle/?xml=1': '<profile><steamID64>7656</steamID64></profile>',
+        '/inventory/': inventory_page,
+    })
+
+    user = User('idle')
+    assert user.gems_total == 20
+    assert len(list(user.traverse_inventory())) == 3
+    assert len(client.requested) == 2
+
+    user.invalidate_inventory()
+    assert user.gems_total == 20
+    assert len(client.requested) == 3
+
+
+def test_inventory_changes(client, tmpdir):
+    inventory = {'total': 3}
+
+    client.responses.update({
+        'idle/?xml=1': '<profile><steamID64>7656</steamID64></profile>',
+        '/inventory/': lambda url, params: inventory_page(url, params, total=inventory['total']),
+    })
+
+    user = User('idle')
+
+    changes = user.poll_inventory_changes()
+    assert sorted(changes.added) == ['1', '2', '3']
+    assert changes.added['3'] == ('1', '0', 10)
+    assert not changes.removed and not changes.changed
+    assert user.inventory.get_amount('1') == 10
+
+    filepath = str(tmpdir.join('snapshot.gz'))
+    user.inventory_snapshot.save(filepath)
+
+    inventory['total'] = 4
+    changes = user.poll_inventory_changes()
+    assert list(changes.added) == ['4']
+    assert user.gems_total == 10
+    assert len(client.requested) == 3
+
+    # Explicitly given empty snapshot is compared to, not the one from previous poll.
+    changes = user.poll_inventory_changes(InventorySnapshot())
+    assert sorted(changes.added) == ['1', '2', '3', '4']
+
+    # Restarted with a persisted snapshot.
+    snapshot = InventorySnapshot.load(filepath)
+    assert len(snapshot) == 3
+
+    snapshot.assets['2'] = ('667924416', '0', 5)
+    del snapshot.assets['1']
+    snapshot.assets['100'] = ('1', '0', 1)
+
+    changes = User('idle').poll_inventory_changes(snapshot)
+    assert sorted(changes.added) == ['1', '4']
+    assert changes.removed == {'100': ('1', '0', 1)}
+    assert changes.changed == {'2': ('667924416', '0', 5, 10)}
+
+
+def test_games_owned(client):
+    client.responses['games'] = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<gamesList><steamID64>7656</steamID64><games>%s</games></gamesList>' % ''.join(
+            '<game><appID>%s</appID><name><![CDATA[Game %s]]></name><hoursOnRecord>1</hoursOnRecord></game>' % (
+                idx, idx) for idx in range(5000)))
+
+    user = User('idle')
+
+    games = user.iter_games_owned()
+    assert next(games) == ('0', 'Game 0')
+    assert len(list(games)) == 4999
+
+    games = user.get_games_owned()
+    assert games['4999'] == {'appid': '4999', 'title': 'Game 4999'}
+
+    client.cache = MemoryCache()
+    assert user.get_games_owned() == games
+    assert user.get_games_owned() == games
+    assert len(client.requested) == 3
+
+
+def test_fetch_raw(client):
+    client.responses['json'] = '{"name": "Гордон"}'.encode('utf-8')
+    client.responses['xml'] = '<?xml version="1.0" encoding="windows-1251"?><a>Гордон</a>'.encode('cp1251')
+
+    assert DataFetcher('http://some/json').fetch_json() == {'name': 'Гордон'}
+    assert DataFetcher('http://some/xml').fetch_xml().text == 'Гордон'
+
+
+def test_fetch_conditional(client, monkeypatch):
+    now = [100]
+    monkeypatch.setattr('steampak.webapi.cache.time', lambda: now[0])
+
+    client.cache = MemoryCache()
+    client.cache_ttls = {'games_owned': 10, 'profile': 10}
+
+    xml = '<a><b>1</b></a>'
+    validators = {'ETag': '"v1"', 'Last-Modified': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+    client.responses['games'] = [(200, xml, validators), (304, '')]
+
+    fetcher = DataFetcher('http://some/games', endpoint='games_owned')
+    parsed = fetcher.fetch_xml()
+    assert parsed.find('b').text == '1'
+    assert client.requested_headers[-1] == {}
+
+    # Fresh in cache.
+    assert fetcher.fetch_xml() is parsed
+    assert len(client.requested) == 1
+
+    # Expired, revalidated. Parsed object reused.
+    now[0] += 20
+    assert fetcher.fetch_xml() is parsed
+    assert len(client.requested) == 2
+    assert client.requested_headers[-1] == {
+        'If-None-Match': '"v1"', 'If-Modified-Since': 'Wed, 21 Oct 2015 07:28:00 GMT'}
+
+    # Revalidation prolongs cached contents.
+    assert fetcher.fetch_content() == xml.encode()
+    assert len(client.requested) == 2
+
+    # Streamed contents are revalidated too.
+    now[0] += 20
+    assert b''.join(fetcher.iter_content()) == xml.encode()
+    assert len(client.requested) == 3
+
+    # Modified.
+    now[0] += 20
+    client.responses['games'] = (200, '<a><b>2</b></a>', {'ETag': '"v2"'})
+    assert fetcher.fetch_xml().find('b').text == '2'
+    assert client.cache.get_entry(fetcher.cache_key).validators == {'ETag': '"v2"'}
+
+    # No validators, no conditional request.
+    client.responses['profile'] = '<a/>'
+    fetcher = DataFetcher('http://some/profile', endpoint='profile')
+    fetcher.fetch_xml()
+    now[0] += 20
+    fetcher.fetch_xml()
+    assert client.requested_headers[-1] == {}
+
+
+def test_deadline(client, run_cli):
+    import asyncio
+
+    assert get_time_left() is None
+
+    with deadline(10):
+        assert 9 < get_time_left() <= 10
+
+        with deadline(20):
+            assert get_time_left() <= 10
+
+        with deadline(None):
+            assert get_time_left() <= 10
+
+    assert get_time_left() is None
+
+    # Request timeouts are shortened to fit deadline.
+    client.responses['priceoverview'] = {'success': True, 'lowest_price': '1'}
+    client.timeout = (5, 30)
+
+    Item('1', 'one').get_price_data()
+    assert client.requested_timeouts[-1] == (5, 30)
+
+    with deadline(10):
+        Item('1', 'one').get_price_data()
+    assert client.requested_timeouts[-1][0] == 5
+    assert 9 < client.requested_timeouts[-1][1] <= 10
+
+    def respond_timed_out(url, params):
+        raise requests.ConnectTimeout('too long')
+
+    client.responses['priceoverview'] = respond_timed_out
+
+    with pytest.raises(RequestTimeout) as e:
+        Item('1', 'one').get_price_data()
+    assert 'too long' in str(e.value)
+    assert e.value.url
+
+    # Deadline is carried into worker threads.
+    times_left = []
+
+    def respond_slowly(url, params):
+        times_left.append(get_time_left())
+        sleep(0.1)
+        return {'success': True, 'results_html': cards_html('One'), 'total_count': 250}
+
+    client.responses['render'] = respond_slowly
+
+    with pytest.raises(DeadlineExceeded):
+        with deadline(0.15):
+            Application('1').get_cards()
+
+    assert len(times_left) == 3  # Page 1, pages 2 and 3 (prefetched).
+    assert all(time_left is not None for time_left in times_left)
+
+    async def run():
+        with deadline(0.05):
+            return await Application('2').get_cards_async(page_size=1)
+
+    times_left.clear()
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert times_left[0] is not None
+
+    # No wait for rate limiter beyond deadline.
+    client.limiter = RateLimiter({'some': (0.01, 1)})
+    client.responses['some'] = {}
+    DataFetcher('http://some/').fetch_content()
+
+    with pytest.raises(DeadlineExceeded):
+        with deadline(5):
+            DataFetcher('http://some/').fetch_content()
+
+    from click.testing import CliRunner
+    from steampak.cli import start
+
+    client.responses['appdetails'] = {'3': {'success': True, 'data': {'name': 'Some'}}}
+    result = CliRunner().invoke(start, ['--no-cache', '--timeout', '0.05', 'app', '3', 'get-card-prices'], obj={})
+    assert isinstance(result.exception, DeadlineExceeded)
+
+
+def test_latency_tracker():
+    latencies = LatencyTracker(window=100)
+    assert latencies.get_percentile('a', 95) is None
+
+    for idx in range(1, 201):
+        latencies.add('a', idx)
+
+    assert latencies.get_count('a') == 100
+    assert latencies.get_count('b') == 0
+    assert latencies.get_percentile('a', 50) == 150
+    assert latencies.get_percentile('a', 95) == 195
+    assert latencies.get_percentile('a', 100) == 200
+
+    policy = HedgePolicy(endpoints=['a', 'b'], percentile=90, samples_min=10)
+    assert policy.get_delay('a', latencies) == 190
+    assert policy.get_delay('b', latencies) is None  # Too few samples.
+    assert policy.get_delay('c', latencies) is None  # Not hedged.
+
+
+def test_fetch_hedged(client):
+    from time import monotonic
+
+    client.hedging = HedgePolicy(samples_min=5)
+    client.limiter = RateLimiter({'steamcommunity.com': (0.001, 3)})
+
+    for _ in range(5):
+        client.latencies.add('priceoverview', 0.01)
+
+    calls = []
+
+    def respond(url, params):
+        calls.append(url)
+
+        if len(calls) == 1:
+            sleep(0.5)
+            return {'success': True, 'lowest_price': '1'}
+
+        return {'success': True, 'lowest_price': '2'}
+
+    client.responses['priceoverview'] = respond
+
+    started = monotonic()
+    assert Item('1', 'one').get_price_data()['lowest_price'] == 2
+    assert monotonic() - started < 0.4
+    assert len(calls) == 2
+
+    # Rate limit budget is exhausted: no hedging.
+    calls.clear()
+    assert Item('1', 'one').get_price_data()['lowest_price'] == 1
+    assert len(calls) == 1
+
+    # Not hedged endpoint.
+    client.limiter = RateLimiter({})
+    client.responses['render'] = lambda url, params: sleep(0.1) or {'results_html': '', 'total_count': 0}
+    client.hedging.endpoints = {'priceoverview'}
+    for _ in range(5):
+        client.latencies.add('market_search', 0.01)
+
+    Application('1').get_cards()
+    assert len(client.requested) == 4
+
+
+def test_fetch_hedged_queued():
+    from concurrent.futures import ThreadPoolExecutor
+
+    client = FakeClient(pool_size=1)  # Two hedge executor workers.
+    client.hedging = HedgePolicy(samples_min=5, delay_min=0.2)
+    client.responses['priceoverview'] = lambda url, params: sleep(0.05) or {'success': True}
+
+    for _ in range(5):
+        client.latencies.add('priceoverview', 0.05)
+
+    # Time spent waiting in executor queue doesn't trigger hedging.
+    with ThreadPoolExecutor(max_workers=12) as executor:
+        futures = [
+            executor.submit(client.fetch, 'http://some/priceoverview/', {'idx': idx}, 'priceoverview')
+            for idx in range(12)]
+        assert all(future.result().status_code == 200 for future in futures)
+
+    assert len(client.requested) == 12
+
+
+def test_metrics(client, monkeypatch):
+    now = [100]
+    monkeypatch.setattr('steampak.webapi.cache.time', lambda: now[0])
+
+    events = []
+
+    class Hook(FetchHook):
+
+        def fetch_started(self, event):
+            events.append(('started', event.endpoint))
+
+        def fetch_finished(self, event):
+            events.append(('finished', event))
+
+    class BrokenHook(FetchHook):
+
+        def fetch_finished(self, event):
+            raise ValueError('oops')
+
+    metrics = MetricsRegistry()
+    client.hooks.extend([Hook(), BrokenHook(), metrics])
+    client.cache = MemoryCache()
+    client.cache_ttls = {'appdetails': 10, 'games_owned': 10}
+
+    client.responses.update({
+        'priceoverview': [(429, ''), {'success': True, 'lowest_price': '1'}],
+        'appdetails': [(200, {'1': {'success': True, 'data': {'name': 'Some'}}}, {'ETag': '"a"'}), (304, '')],
+        'games': '<gamesList><games><game><appID>1</appID><name>Some</name></game></games></gamesList>',
+    })
+
+    Item('1', 'one').get_price_data()
+
+    assert events[0] == ('started', 'priceoverview')
+    event = events[1][1]
+    assert event.status == 200
+    assert event.kind == 'json'
+    assert event.retries == 1
+    assert event.throttled == 1
+    assert event.size > 10
+    assert event.parse_time > 0
+    assert event.duration >= event.network_time > 0
+    assert event.error is None
+
+    app = Application('1')
+    assert app.title == 'Some'
+    app.invalidate()
+    assert app.title == 'Some'  # Cached.
+    now[0] += 20
+    app.invalidate()
+    assert app.title == 'Some'  # Revalidated.
+
+    user = User('idle', steamid='123')
+    assert user.get_games_owned() == {'1': {'appid': '1', 'title': 'Some'}}
+
+    client.responses['render'] = (500, 'not a json')
+    with pytest.raises(ValueError):
+        DataFetcher('http://some/render', endpoint='market_search').fetch_json()
+
+    assert events[-1][1].error is not None
+
+    assert metrics.endpoints == ['appdetails', 'games_owned', 'market_search', 'priceoverview']
+
+    prices = metrics.get('priceoverview')
+    assert prices.fetches == 1
+    assert prices.requests == 2
+    assert prices.throttled == 1
+    assert prices.network_time.count == 1
+
+    details = metrics.get('appdetails')
+    assert details.fetches == 3
+    assert details.requests == 2
+    assert details.cached == 2
+    assert details.revalidated == 1
+    assert details.parse_time.count == 1  # Parsed object reused.
+
+    games = metrics.get('games_owned')
+    assert games.fetches == 1
+    assert games.bytes > 50
+
+    assert metrics.get('market_search').errors == 1
+    assert metrics.get('unknown').fetches == 0
+
+    data = metrics.as_dict()
+    assert data['priceoverview']['requests'] == 2
+    assert data['priceoverview']['duration']['count'] == 1
+
+    metrics.reset()
+    assert metrics.endpoints == []
+
+
+def test_histogram():
+    histogram = Histogram(buckets=(1, 2, 5, float('inf')))
+    assert histogram.get_percentile(50) is None
+
+    for value in (0.5, 0.5, 1.5, 3, 100):
+        histogram.observe(value)
+
+    assert histogram.get_percentile(40) == 1
+    assert histogram.get_percentile(60) == 2
+    assert histogram.get_percentile(80) == 5
+    assert histogram.get_percentile(100) == float('inf')
+    assert histogram.as_dict() == {
+        'count': 5, 'sum': 105.5, 'buckets': [(1, 2), (2, 3), (5, 4), (float('inf'), 5)]}
+
+
+def test_fetch_coalesced(client):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    def respond_slowly(url, params):
+        sleep(0.2)
+        return {'success': True, 'lowest_price': '1'}
+
+    client.responses['priceoverview'] = respond_slowly
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(Item('1', 'one')._get_price_fetcher(5).fetch_json) for _ in range(4)]
+        results = [future.result() for future in futures]
+
+    assert len(client.requested) == 1
+    assert all(result is results[0] for result in results)
+
+    # Different parameters, different requests.
+    Item.get_prices([Item('1', 'one'), Item('1', 'two')], 'USD')
+    assert len(client.requested) == 3
+
+    async def run():
+        return await asyncio.gather(*[Item('1', 'one').get_price_data_async('USD') for _ in range(5)])
+
+    prices = asyncio.run(run())
+    assert len(client.requested) == 4
+    assert all(price['lowest_price'] == 1 for price in prices)
+
+    # Finished requests are not reused.
+    Item('1', 'one').get_price_data('USD')
+    assert len(client.requested) == 5
+
+    client.flights = None
+    asyncio.run(run())
+    assert len(client.requested) == 10
+
+
+def test_fetch_coalesced_deadlines(client):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    def respond_slowly(url, params):
+        sleep(0.3)
+        check_deadline(url)  # Emulates request timeout shortened to fit deadline.
+        return {'success': True}
+
+    client.responses['some'] = respond_slowly
+
+    def fetch(seconds, pause):
+        sleep(pause)
+        with deadline(seconds):
+            return DataFetcher('http://some/').fetch_json()
+
+    # Caller joining a request in flight isn't limited by deadline of the caller who made it.
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        short = executor.submit(fetch, 0.1, 0)
+        long = executor.submit(fetch, None, 0.05)
+
+        with pytest.raises(DeadlineExceeded):
+            short.result()
+
+        assert long.result() == {'success': True}
+
+    assert len(client.requested) == 2
+
+    async def fetch_async(seconds, pause):
+        await asyncio.sleep(pause)
+        with deadline(seconds):
+            return await AsyncDataFetcher('http://some/').fetch_json()
+
+    async def run():
+        return await asyncio.gather(fetch_async(0.1, 0), fetch_async(None, 0.05), return_exceptions=True)
+
+    short, long = asyncio.run(run())
+    assert isinstance(short, DeadlineExceeded)
+    assert long == {'success': True}
+    assert len(client.requested) == 4
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('$0.03', '0.03'),
+    ('$1,234.56 USD', '1234.56'),
+    ('£1.5', '1.5'),
+    ('1,23€', '1.23'),
+    ('1.234,56€', '1234.56'),
+    ('12,--€', '12.00'),
+    ('1 234,56 pуб.', '1234.56'),
+    ('1\u00a0234 pуб.', '1234'),
+    ("CHF 1'234.56", '1234.56'),
+    ('1,234', '1234'),
+    ('1.234.567', '1234567'),
+    ('7', '7'),
+    ('', '0'),
+    ('n/a', '0'),
+])
+def test_parse_money(value, expected):
+    assert str(parse_money(value)) == expected
+
+
+def test_normalize_price_data():
+    normalized = normalize_price_data([
+        {'success': True, 'lowest_price': '$1.50', 'volume': '1,234', 'median_price': '$2.00'},
+        {'success': False},
+        None,
+    ], 1)
+
+    assert normalized[1:] == [{}, {}]
+    assert normalized[0] == {
+        'success': True, 'lowest_price': parse_money('1.50'), 'median_price': 2, 'volume': 1234, 'currency': 'USD'}
+
+
+def test_price_history(client, tmpdir, monkeypatch):
+    history = PriceHistory(str(tmpdir.join('prices.db')))
+
+    history.append_many([
+        ('1-one', {'currency': 'USD', 'lowest_price': 1, 'median_price': 2, 'volume': 3}),
+        ('1-one', {'currency': 'EUR', 'lowest_price': 4, 'median_price': 5, 'volume': 6}),
+        ('1-two', {}),
+    ], timestamp=100)
+    history.append('1-one', {'currency': 'USD', 'lowest_price': 7, 'median_price': 8, 'volume': 9}, timestamp=200)
+
+    assert [point.lowest_price for point in history.get_range('1-one', 'USD')] == [1, 7]
+    assert history.get_range('1-one', 'USD', since=150) == [(200, 7, 8, 9)]
+    assert history.get_range('1-one', 'USD', until=150) == [(100, 1, 2, 3)]
+    assert history.get_last('1-one', 'EUR').volume == 6
+    assert history.get_last('1-one', 'EUR', max_age=100) is None
+    assert history.get_last('1-two', 'USD') is None
+
+    history.close()
+
+    monkeypatch.setattr(Item, 'price_history', PriceHistory())
+    client.responses['priceoverview'] = {'success': True, 'lowest_price': '$1.50'}
+
+    item = Item('1', 'one')
+    assert item.get_price_last('USD') == {}
+
+    item.get_price_data('USD')
+    assert len(client.requested) == 1
+
+    item = Item('1', 'one')
+    assert item.get_price_data('USD', max_age=60)['lowest_price'] == parse_money('1.50')
+    assert item.price_currency == 'USD'
+    assert len(client.requested) == 1
+
+    item.get_price_data('EUR', max_age=60)
+    assert len(client.requested) == 2
+    assert len(Item.price_history.get_range('1-one', 'EUR')) == 1
+
+
+def test_price_stale_while_revalidate(client, monkeypatch):
+    from threading import Event
+
+    now = [1000]
+    monkeypatch.setattr('steampak.webapi.resources.market.monotonic', lambda: now[0])
+    monkeypatch.setattr(Item, 'price_max_age', 60)
+
+    prices = ['$1.00']
+    release = Event()
+
+    def price(url, params):
+        if len(client.requested) > 1:
+            release.wait(5)
+        return {'success': True, 'lowest_price': prices[0]}
+
+    client.responses['priceoverview'] = price
+
+    item = Item('1', 'one')
+    assert item.price_lowest == 1  # Blocks on the first access.
+    assert not item.price_stale
+
+    now[0] += 61
+    prices[0] = '$2.00'
+    assert item.price_stale
+
+    other = Item('1', 'one')
+    other._use_price_data(item._price_data, item._price_currency, fetched=now[0] - 61)
+
+    # Stale values are returned at once, refresh is started in background.
+    assert item.price_lowest == 1
+    assert other.price_lowest == 1
+    assert item.price_median == 0
+
+    future = item.refresh_price_data()
+    assert other.refresh_price_data() is future
+
+    release.set()
+    future.result()
+
+    for _ in range(100):  # Done callbacks may still be running.
+        if other._price_data['lowest_price'] == 2:
+            break
+        sleep(0.01)
+
+    assert item.price_lowest == 2
+    assert other.price_lowest == 2
+    assert not item.price_stale
+    assert len(client.requested) == 2